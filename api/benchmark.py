@@ -0,0 +1,55 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from models import columns, Game
+from responses import ORJSONResponse, as_dicts
+
+# Fetching and serializing the same games as ORM instances with jsonable_encoder and as plain rows with orjson.
+# Run it in the api container against a loaded database: python benchmark.py [number of games]
+SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}@{os.getenv('POSTGRES_HOST', 'localhost')}:5432/{os.getenv('POSTGRES_DB')}"
+ROUNDS = int(os.getenv("BENCHMARK_ROUNDS", "5"))
+
+
+async def best_of(function):
+    # Best time in milliseconds and the last result
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        result = await function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings), result
+
+
+async def main(limit):
+    engine = create_async_engine(SQLALCHEMY_DATABASE_URL)
+    async with AsyncSession(engine) as db:
+        async def fetch_instances():
+            return (await db.execute(select(Game).order_by(Game.gameid).limit(limit))).scalars().all()
+
+        async def fetch_rows():
+            return as_dicts(await db.execute(select(*columns(Game)).order_by(Game.gameid).limit(limit)))
+
+        instances_time, instances = await best_of(fetch_instances)
+        rows_time, rows = await best_of(fetch_rows)
+
+    async def encode_instances():
+        return json.dumps(jsonable_encoder(instances)).encode()
+
+    async def encode_rows():
+        return ORJSONResponse(rows).body
+
+    encoder_time, _ = await best_of(encode_instances)
+    orjson_time, _ = await best_of(encode_rows)
+    await engine.dispose()
+    print(f"{len(rows)} games, best of {ROUNDS}")
+    print(f"  fetch      ORM instances {instances_time:.0f} ms  ->  rows as dicts {rows_time:.0f} ms")
+    print(f"  serialize  jsonable_encoder + json {encoder_time:.0f} ms  ->  orjson {orjson_time:.0f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000))
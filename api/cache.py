@@ -0,0 +1,79 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from sqlalchemy import text
+
+
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+DATASET_VERSION_TTL = float(os.getenv("DATASET_VERSION_TTL", "30"))
+
+
+class DatasetVersion:
+    # The fetcher stamps a new version after every load, it is polled at most once every ttl seconds
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.version = None
+        self.checked_at = None
+
+    async def get(self, engine):
+        now = time.monotonic()
+        if self.checked_at is None or now - self.checked_at >= self.ttl:
+            try:
+                async with engine.connect() as conn:
+                    result = await conn.execute(text("SELECT MAX(version) FROM dataset_version"))
+                    self.version = result.scalar()
+            except Exception:
+                self.version = None
+            self.checked_at = now
+        return self.version
+
+
+class ResponseCache:
+    # LRU cache of serialized responses bounded by the total size of the bodies
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.version = None
+        self.entries = OrderedDict()
+
+    def get(self, key, version):
+        if version != self.version:
+            # Entries of older datasets can never be hit again
+            self.entries.clear()
+            self.size = 0
+            self.version = version
+            return None
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key, version, body):
+        entry = (body, etag(body))
+        if version != self.version or len(body) > self.max_bytes:
+            return entry
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key)[0])
+        self.entries[key] = entry
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+        return entry
+
+
+def etag(body):
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def cache_key(request):
+    return (request.url.path, tuple(sorted(request.query_params.multi_items())))
+
+
+def etag_matches(request, tag):
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [value.strip() for value in if_none_match.split(",")]
+    return "*" in tags or tag in tags or f"W/{tag}" in tags
@@ -0,0 +1,41 @@
+import csv
+import io
+import os
+import orjson
+from fastapi.responses import StreamingResponse
+from responses import json_default
+
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+async def stream_rows(engine, query, format):
+    # Server side cursor: rows are fetched and sent in batches, never the whole table at once
+    async with engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        keys = list(result.keys())
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(keys)
+            yield buffer.getvalue()
+            async for rows in result.partitions():
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(rows)
+                yield buffer.getvalue()
+        else:
+            async for rows in result.partitions():
+                yield b"".join(orjson.dumps(dict(zip(keys, row)), default=json_default, option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+
+
+def export_response(engine, query, format, name):
+    return StreamingResponse(
+        stream_rows(engine, query, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'},
+    )
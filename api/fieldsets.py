@@ -0,0 +1,59 @@
+from fastapi import HTTPException
+from sqlalchemy.orm import aliased
+from models import columns
+
+
+def split(value):
+    return [item.strip() for item in value.split(",") if item.strip()] if value else []
+
+
+def project(query, keys, fields, expand, relations):
+    # Narrow the select to the requested columns and join the requested relations in the same query.
+    # relations maps every name to the related model, the column of the listed model and the column of the related one
+    fields = split(fields)
+    expand = split(expand)
+    unknown = [name for name in expand if name not in relations]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown relations: {', '.join(unknown)}")
+    model = query.column_descriptions[0]["entity"]
+    own = {column.key: column for column in columns(model)}
+    selected = [field for field in fields if "." not in field]
+    unknown = [field for field in selected if field not in own]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    related_fields = {}
+    for field in fields:
+        if "." in field:
+            name, column = field.split(".", 1)
+            if name not in expand:
+                raise HTTPException(status_code=400, detail=f"Field {field} needs expand={name}")
+            related_fields.setdefault(name, []).append(column)
+    if selected:
+        # The keys are always returned, pagination needs them
+        projection = [own[key.key] for key in keys if key.key not in selected] + [own[field] for field in selected]
+    else:
+        projection = list(own.values())
+    for name in expand:
+        related, own_column, related_column = relations[name]
+        alias = aliased(related, name=name)
+        related_columns = {column.key: column for column in columns(alias)}
+        names = related_fields.get(name, list(related_columns))
+        unknown = [field for field in names if field not in related_columns]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields of {name}: {', '.join(unknown)}")
+        if related_column not in names:
+            # The key tells a missing related row from one with null columns
+            names = [related_column] + names
+        projection += [related_columns[field].label(f"{name}.{field}") for field in names]
+        query = query.outerjoin(alias, getattr(alias, related_column) == getattr(model, own_column))
+    return query.with_only_columns(*projection), expand
+
+
+def nest(items, expand):
+    # The columns of every expanded relation become an object, null when there is no related row
+    for item in items:
+        for name in expand:
+            prefix = f"{name}."
+            related = {key[len(prefix):]: item.pop(key) for key in [key for key in item if key.startswith(prefix)]}
+            item[name] = related if any(value is not None for value in related.values()) else None
+    return items
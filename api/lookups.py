@@ -0,0 +1,43 @@
+import asyncio
+from sqlalchemy import select
+from models import columns, Award, Race, Variant
+from responses import as_dicts
+
+
+class LookupTables:
+    # Races, variants and awards are a few rows that only change with a new load, they are kept in memory per dataset version
+    def __init__(self):
+        self.version = None
+        self.loaded = False
+        self.races = []
+        self.variants = []
+        self.awards = []
+        self.lock = asyncio.Lock()
+
+    async def get(self, engine, version):
+        if self.loaded and (version is None or version == self.version):
+            return self
+        async with self.lock:
+            if not self.loaded or (version is not None and version != self.version):
+                async with engine.connect() as conn:
+                    self.races = as_dicts(await conn.execute(select(*columns(Race)).order_by(Race.raceid)))
+                    self.variants = as_dicts(await conn.execute(select(*columns(Variant)).order_by(Variant.variantid)))
+                    self.awards = as_dicts(await conn.execute(select(*columns(Award)).order_by(Award.id)))
+                self.version = version
+                self.loaded = True
+        return self
+
+    def race_ids(self, name):
+        return matching_ids(self.races, "raceid", "name", name)
+
+    def variant_ids(self, name):
+        return matching_ids(self.variants, "variantid", "variantname", name)
+
+    def award_ids(self, name):
+        return matching_ids(self.awards, "id", "name", name)
+
+
+def matching_ids(rows, key, column, name):
+    # Same matches as the ILIKE '%name%' filters they replace
+    name = name.lower()
+    return [row[key] for row in rows if row[column] is not None and name in row[column].lower()]
@@ -1,12 +1,30 @@
 from fastapi import FastAPI
+import logging
 import os
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from fastapi import Depends, FastAPI, HTTPException, Path, Query, Request, Body
+from fastapi.responses import Response
+from sqlalchemy import ARRAY, Float, Integer, Select, any_, bindparam, func, literal
+from sqlalchemy.dialects.postgresql import array
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import Member, Tournament, TournamentCoach, Game, Race, Variant, Award, TournamentStatistic, CoachRankingVariant
+from models import columns, Member, Tournament, TournamentCoach, Game, Race, Variant, Award, TournamentStatistic, CoachRankingVariant, CoachStat, GameParticipant, HeadToHead, RaceMatchup, RatingHistory, RankingSnapshot, RankingPosition, TournamentStanding
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, date_order, decode_cursor, decode_date_cursor, paginate, paginate_by_date, page, page_by_date
+from export import export_response
+from responses import ORJSONResponse, as_dicts
+from fieldsets import nest, project, split
+from lookups import LookupTables
+from cache import CACHE_MAX_BYTES, DATASET_VERSION_TTL, DatasetVersion, ResponseCache, cache_key, etag_matches
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+SEARCH_SIMILARITY = os.getenv("SEARCH_SIMILARITY", "0.3")
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", "1000"))
+AGGREGATE_MAX_GROUPS = int(os.getenv("AGGREGATE_MAX_GROUPS", "10000"))
+# Text search configuration of the tsvector columns in init.sql
+FULL_TEXT_CONFIG = "english"
+
 
 
 root_path = os.getenv("ROOT_PATH", "api")
@@ -32,10 +50,22 @@ tags_metadata = [
         "name": "Rankings",
         "description": "Rankings are the standings of players based on their performance in tournaments.",
     },    
+    {
+        "name": "Statistics",
+        "description": "Aggregates of the games precomputed by the fetcher after every load.",
+    },
     {
         "name": "Common Data",
         "description": "Common data includes variants, races, and other shared information.",
     },    
+    {
+        "name": "Search",
+        "description": "Ranked and typo tolerant search of coaches and tournaments by name, and name autocomplete.",
+    },
+    {
+        "name": "Export",
+        "description": "Full exports of the tables as NDJSON or CSV, streamed row by row. They accept the same filters as the list endpoints.",
+    },
 ]
 app = FastAPI(title="NAF API", root_path=f"/{root_path}", openapi_tags=tags_metadata, summary="NAF API to use data from the daily dumps of the NAF database", description="Feel free to your own service and customize it to your needs. You can find the [source code](https://github.com/gr4n0t4/naf-api) in my github repository", version="0.0.1")
 
@@ -55,6 +85,42 @@ engine = create_async_engine(
 )
 
 
+dataset_version = DatasetVersion(DATASET_VERSION_TTL)
+response_cache = ResponseCache(CACHE_MAX_BYTES)
+lookup_tables = LookupTables()
+
+
+@app.on_event("startup")
+async def load_lookup_tables():
+    # When the database is not ready yet they are loaded by the first request that needs them
+    try:
+        await lookup_tables.get(engine, await dataset_version.get(engine))
+    except Exception:
+        logger.exception("Lookup tables not loaded at startup, the first request that needs them will load them")
+
+
+@app.middleware("http")
+async def cache_responses(request: Request, call_next):
+    # The data only changes when the fetcher loads a new dump, so JSON responses are cached per dataset version
+    if request.method != "GET":
+        return await call_next(request)
+    version = await dataset_version.get(engine)
+    if version is None:
+        return await call_next(request)
+    key = cache_key(request)
+    entry = response_cache.get(key, version)
+    if entry is None:
+        response = await call_next(request)
+        if response.status_code != 200 or response.headers.get("content-type") != "application/json":
+            return response
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        entry = response_cache.set(key, version, body)
+    body, etag = entry
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
 # Dependency to get database session
 async def get_async_db():
 
@@ -65,12 +131,54 @@ async def get_async_db():
             await session.close()
 
 
+# Dependency to get the races, variants and awards of the current dataset
+async def get_lookups():
+    try:
+        return await lookup_tables.get(engine, await dataset_version.get(engine))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+
+async def full_text_search(db, columns, keys, vector, document, q, limit):
+    # Rank the matches with the GIN indexed tsvector, snippets are only built for the returned rows.
+    # The primary key breaks the ties of the rank
+    query = func.websearch_to_tsquery(FULL_TEXT_CONFIG, q)
+    rank = func.ts_rank_cd(vector, query)
+    hits = (
+        select(*columns, rank.label("rank"), document.label("document"))
+        .where(vector.op("@@")(query))
+        .order_by(rank.desc(), *keys)
+        .limit(limit)
+        .subquery()
+    )
+    snippet = func.ts_headline(FULL_TEXT_CONFIG, hits.c.document, query, "MaxFragments=2, MaxWords=30, MinWords=10")
+    result = await db.execute(
+        select(*[hits.c[column.key] for column in columns], hits.c.rank, snippet.label("snippet"))
+        .order_by(hits.c.rank.desc(), *[hits.c[key.key] for key in keys])
+    )
+    return result.mappings().all()
 
-@app.get("/members",
-         responses={200: {"content": {"application/json": {},}}},
-         tags=["Members"],)
-async def get_members(
-    request: Request,  
+
+async def batch_lookup(db, model, key, ids, fields=None, expand=None, relations=None):
+    # One query for all the ids, the items come back in the order they were asked for
+    relations = relations or {}
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No ids given")
+    if len(ids) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_IDS} ids can be looked up at once")
+    query, expand = project(select(*columns(model)), (key,), fields, expand, relations)
+    try:
+        result = await db.execute(query.where(key == any_(bindparam("ids", ids, type_=ARRAY(Integer)))))
+        found = {item[key.key]: item for item in nest(as_dicts(result), expand)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return ORJSONResponse({"items": [found[item_id] for item_id in ids if item_id in found], "missing": [item_id for item_id in ids if item_id not in found]})
+
+
+
+
+def members_query(
     naf_name: str = Query(None),
     naf_number: int = Query(None),
     country: str = Query(None),
@@ -78,34 +186,68 @@ async def get_members(
     expire_date_lte: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$"),
     registration_date_gte: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$"),
     registration_date_lte: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$"),
+):
+    query = select(*columns(Member))
+    if naf_name:
+        query = query.where(Member.naf_name.ilike(f"%{naf_name}%"))
+    if naf_number:
+        query = query.where(Member.naf_number == naf_number)
+    if country:
+        query = query.where(Member.country.ilike(f"%{country}%"))
+    if expire_date_gte:
+        expire_date_gte = datetime.strptime(expire_date_gte, "%Y-%m-%d").date()
+        query = query.where(Member.expire_date >= expire_date_gte)
+    if expire_date_lte:
+        expire_date_lte = datetime.strptime(expire_date_lte, "%Y-%m-%d").date()
+        query = query.where(Member.expire_date <= expire_date_lte)
+    if registration_date_gte:
+        registration_date_gte = datetime.strptime(registration_date_gte, "%Y-%m-%d").date()
+        query = query.where(Member.registration_date >= registration_date_gte)
+    if registration_date_lte:
+        registration_date_lte = datetime.strptime(registration_date_lte, "%Y-%m-%d").date()
+        query = query.where(Member.registration_date <= registration_date_lte)
+    return query
+
+@app.get("/members",
+         responses={200: {"content": {"application/json": {},}}},
+         tags=["Members"],)
+async def get_members(
+    request: Request,
+    query: Select = Depends(members_query),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of items to return"),
+    cursor: str = Query(None, description="Cursor returned as `next` by the previous page"),
+    fields: str = Query(None, description="Comma separated columns to return"),
     db: AsyncSession = Depends(get_async_db),
 ):
+    keys = (Member.naf_number,)
+    cursor = decode_cursor(cursor, keys)
+    query, _ = project(query, keys, fields, None, {})
     try:
-        query = select(Member)
-        if naf_name:
-            query = query.where(Member.naf_name.ilike(f"%{naf_name}%"))
-        if naf_number:
-            query = query.where(Member.naf_number == naf_number)
-        if country:
-            query = query.where(Member.country.ilike(f"%{country}%"))
-        if expire_date_gte:
-            expire_date_gte = datetime.strptime(expire_date_gte, "%Y-%m-%d").date()
-            query = query.where(Member.expire_date >= expire_date_gte)
-        if expire_date_lte:
-            expire_date_lte = datetime.strptime(expire_date_lte, "%Y-%m-%d").date()
-            query = query.where(Member.expire_date <= expire_date_lte)
-        if registration_date_gte:
-            registration_date_gte = datetime.strptime(registration_date_gte, "%Y-%m-%d").date()
-            query = query.where(Member.registration_date >= registration_date_gte)
-        if registration_date_lte:
-            registration_date_lte = datetime.strptime(registration_date_lte, "%Y-%m-%d").date()
-            query = query.where(Member.registration_date <= registration_date_lte)
-        
-        result = await db.execute(query)
-        members = result.scalars().all()
+        result = await db.execute(paginate(query, keys, cursor, limit))
+        members = as_dicts(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")        
-    return members
+    return ORJSONResponse(page(members, keys, limit))
+
+@app.get("/members/batch",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Members"],)
+async def get_members_batch(
+    ids: list[int] = Query(..., description="NAF numbers to look up, repeated (`ids=1&ids=2`) and returned in that order"),
+    fields: str = Query(None, description="Comma separated columns to return"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await batch_lookup(db, Member, Member.naf_number, ids, fields)
+
+@app.post("/members/batch",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Members"],)
+async def post_members_batch(
+    ids: list[int] = Body(..., embed=True, description="NAF numbers to look up, returned in that order"),
+    fields: str = Query(None, description="Comma separated columns to return"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await batch_lookup(db, Member, Member.naf_number, ids, fields)
 
 @app.get("/members/{naf_number}",
             responses={200: {"content": {"application/json": {},}}},
@@ -115,14 +257,14 @@ async def get_member_by_id(
     db: AsyncSession = Depends(get_async_db),
 ):
     try:
-        query = select(Member).where(Member.naf_number == naf_number)
+        query = select(*columns(Member)).where(Member.naf_number == naf_number)
         result = await db.execute(query)
-        member = result.scalar_one_or_none()
+        member = result.one_or_none()
         if not member:
             raise HTTPException(status_code=404, detail="Member not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    return member
+    return ORJSONResponse(member)
 
 @app.get("/member/{naf_number}/tournaments",
             responses={200: {"content": {"application/json": {},}}},
@@ -131,26 +273,134 @@ async def get_member_tournaments(
     naf_number: int = Path(..., description="The NAF number of the member"),
     tournament_nation: str = Query(None, description="Filter tournaments by nation"),
     race_name: str = Query(None, description="Filter tournaments by race name"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of items to return"),
+    cursor: str = Query(None, description="Cursor returned as `next` by the previous page"),
+    lookups: LookupTables = Depends(get_lookups),
     db: AsyncSession = Depends(get_async_db),
 ):
+    keys = (Tournament.tournamentid,)
+    cursor = decode_cursor(cursor, keys)
     try:
-        query = (
-            select(Tournament)
-            .join(TournamentCoach, Tournament.tournamentid == TournamentCoach.tournamentid)
-            .where(TournamentCoach.coachid == naf_number)
-        )
+        # Semi join, a coach is registered once per race and every tournament is returned once
+        registered = select(TournamentCoach.tournamentid).where(TournamentCoach.coachid == naf_number)
+        if race_name:
+            registered = registered.where(TournamentCoach.raceid.in_(lookups.race_ids(race_name)))
+        query = select(*columns(Tournament)).where(Tournament.tournamentid.in_(registered))
         if tournament_nation:
             query = query.where(Tournament.tournamentnation.ilike(f"%{tournament_nation}%"))
-        if race_name:
-            query = query.join(Race, TournamentCoach.raceid == Race.raceid).where(Race.name.ilike(f"%{race_name}%"))
         
-        result = await db.execute(query)
-        tournaments = result.scalars().all()
-        if not tournaments:
+        result = await db.execute(paginate(query, keys, cursor, limit))
+        tournaments = as_dicts(result)
+        if not tournaments and cursor is None:
             raise HTTPException(status_code=404, detail="No tournaments found for this member")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    return tournaments
+    return ORJSONResponse(page(tournaments, keys, limit))
+
+STAT_COUNTS = ("games", "wins", "draws", "losses", "td_for", "td_against", "cas_for", "cas_against")
+
+@app.get("/member/{naf_number}/stats",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Members"],)
+async def get_member_stats(
+    naf_number: int = Path(..., description="The NAF number of the member"),
+    race_id: int = Query(None, description="Filter stats by race ID"),
+    variant_id: int = Query(None, description="Filter stats by variant ID"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Precomputed by the fetcher after every load, one row per race and variant played
+    try:
+        query = select(*columns(CoachStat)).where(CoachStat.coachid == naf_number)
+        if race_id is not None:
+            query = query.where(CoachStat.raceid == race_id)
+        if variant_id is not None:
+            query = query.where(CoachStat.variantid == variant_id)
+        result = await db.execute(query.order_by(CoachStat.raceid, CoachStat.variantid))
+        stats = as_dicts(result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if not stats:
+        raise HTTPException(status_code=404, detail="No games found for this member")
+    totals = {count: sum(stat[count] for stat in stats) for count in STAT_COUNTS}
+    totals["first_game"] = min((stat["first_game"] for stat in stats if stat["first_game"]), default=None)
+    totals["last_game"] = max((stat["last_game"] for stat in stats if stat["last_game"]), default=None)
+    return ORJSONResponse({"naf_number": naf_number, "totals": totals, "items": stats})
+
+@app.get("/member/{naf_number}/vs/{opponent}",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Members"],)
+async def get_member_head_to_head(
+    naf_number: int = Path(..., description="The NAF number of the member"),
+    opponent: int = Path(..., description="The NAF number of the opponent"),
+    last: int = Query(10, ge=0, le=MAX_PAGE_SIZE, description="Number of most recent games between them to return"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Pairs are stored once with the lower NAF number first, both lookups use the same keys
+    coach_a, coach_b = min(naf_number, opponent), max(naf_number, opponent)
+    try:
+        result = await db.execute(select(*columns(HeadToHead)).where(HeadToHead.coach_a == coach_a, HeadToHead.coach_b == coach_b))
+        record = result.one_or_none()
+        games = []
+        if record and last:
+            result = await db.execute(
+                select(*columns(Game))
+                .where(func.least(Game.homecoachid, Game.awaycoachid) == coach_a, func.greatest(Game.homecoachid, Game.awaycoachid) == coach_b)
+                .order_by(Game.date.desc().nulls_last(), Game.gameid.desc())
+                .limit(last)
+            )
+            games = as_dicts(result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if not record:
+        raise HTTPException(status_code=404, detail="These members never played each other")
+    first = naf_number == coach_a
+    return ORJSONResponse({
+        "naf_number": naf_number,
+        "opponent": opponent,
+        "games": record.games,
+        "wins": record.wins_a if first else record.wins_b,
+        "draws": record.draws,
+        "losses": record.wins_b if first else record.wins_a,
+        "td_for": record.td_a if first else record.td_b,
+        "td_against": record.td_b if first else record.td_a,
+        "td_diff": (record.td_a - record.td_b) * (1 if first else -1),
+        "races": record.races_a if first else record.races_b,
+        "opponent_races": record.races_b if first else record.races_a,
+        "first_game": record.first_game,
+        "last_game": record.last_game,
+        "last_games": games,
+    })
+
+@app.get("/member/{naf_number}/ranking-history",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Members"],)
+async def get_member_ranking_history(
+    naf_number: int = Path(..., description="The NAF number of the member"),
+    race_id: int = Query(None, description="Filter the history by race ID"),
+    variant_id: int = Query(None, description="Filter the history by variant ID"),
+    date_gte: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$", description="Filter rating periods starting on or after this date"),
+    date_lte: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$", description="Filter rating periods starting on or before this date"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Rating after every rating period the member played, replayed by the fetcher from the games
+    try:
+        query = select(*columns(RatingHistory)).where(RatingHistory.coachid == naf_number)
+        if race_id is not None:
+            query = query.where(RatingHistory.raceid == race_id)
+        if variant_id is not None:
+            query = query.where(RatingHistory.variantid == variant_id)
+        if date_gte:
+            query = query.where(RatingHistory.period >= datetime.strptime(date_gte, "%Y-%m-%d").date())
+        if date_lte:
+            query = query.where(RatingHistory.period <= datetime.strptime(date_lte, "%Y-%m-%d").date())
+        result = await db.execute(query.order_by(RatingHistory.raceid, RatingHistory.variantid, RatingHistory.period))
+        history = as_dicts(result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if not history:
+        raise HTTPException(status_code=404, detail="No rating history found for this member")
+    return ORJSONResponse({"items": history})
+
 @app.get("/member/{naf_number}/games",
             responses={200: {"content": {"application/json": {},}}},
             tags=["Members"],)
@@ -161,38 +411,39 @@ async def get_member_games(
     date_lte: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$", description="Filter games by end date (less than or equal to)"),
     variant_name: str = Query(None, description="Filter games by variant name"),
     variant_id: int = Query(None, description="Filter games by variant ID"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of items to return"),
+    cursor: str = Query(None, description="Cursor returned as `next` by the previous page"),
+    lookups: LookupTables = Depends(get_lookups),
     db: AsyncSession = Depends(get_async_db),
 ):
+    cursor = decode_date_cursor(cursor)
     try:
-        query = select(Game).where(
-            (Game.homecoachid == naf_number) | (Game.awaycoachid == naf_number)
+        # One participant row per game of the member, latest last. The pages and the date filters are ranges of the (coachid, date, gameid) index
+        query = (
+            select(*columns(Game))
+            .join(GameParticipant, GameParticipant.gameid == Game.gameid)
+            .where(GameParticipant.coachid == naf_number)
         )
         if tournamentid:
-            query = query.where(Game.tournamentid == tournamentid)
+            query = query.where(GameParticipant.tournamentid == tournamentid)
         if date_gte:
-            date_gte = datetime.strptime(date_gte, "%Y-%m-%d")
-            query = query.where(Game.date >= date_gte)
+            query = query.where(date_order(GameParticipant.date) >= datetime.strptime(date_gte, "%Y-%m-%d").date(), GameParticipant.date.is_not(None))
         if date_lte:
-            date_lte = datetime.strptime(date_lte, "%Y-%m-%d")
-            query = query.where(Game.date <= date_lte)
+            query = query.where(date_order(GameParticipant.date) <= datetime.strptime(date_lte, "%Y-%m-%d").date())
         if variant_name:
-            query = query.join(Variant, Game.variantsid == Variant.variantid).where(Variant.variantname.ilike(f"%{variant_name}%"))
+            query = query.where(GameParticipant.variantid.in_(lookups.variant_ids(variant_name)))
         if variant_id:
-            query = query.where(Game.variantsid == variant_id)
-        result = await db.execute(query)
-        games = result.scalars().all()
-        if not games:
+            query = query.where(GameParticipant.variantid == variant_id)
+        result = await db.execute(paginate_by_date(query, GameParticipant.date, GameParticipant.gameid, cursor, limit))
+        games = as_dicts(result)
+        if not games and cursor is None:
             raise HTTPException(status_code=404, detail="No games found for this member")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    return games
+    return ORJSONResponse(page_by_date(games, "date", "gameid", limit))
 
 
-@app.get("/tournaments",
-            responses={200: {"content": {"application/json": {},}}},
-            tags=["Tournaments"],)
-async def get_tournaments(
-    request: Request,
+def tournaments_query(
     tournamentid: int = Query(None),
     tournamentorganizerid: int = Query(None),
     tournamentname: str = Query(None),
@@ -206,52 +457,130 @@ async def get_tournaments(
     tournamenttype: str = Query(None),
     tournamentstyle: str = Query(None),
     tournamentstatus: str = Query(None),
+):
+    query = select(*columns(Tournament))
+    if tournamentid:
+        query = query.where(Tournament.tournamentid == tournamentid)
+    if tournamentorganizerid:
+        query = query.where(Tournament.tournamentorganizerid == tournamentorganizerid)
+    if tournamentname:
+        query = query.where(Tournament.tournamentname.ilike(f"%{tournamentname}%"))
+    if tournamentcity:
+        query = query.where(Tournament.tournamentcity.ilike(f"%{tournamentcity}%"))
+    if tournamentstate:
+        query = query.where(Tournament.tournamentstate.ilike(f"%{tournamentstate}%"))
+    if tournamentnation:
+        query = query.where(Tournament.tournamentnation.ilike(f"%{tournamentnation}%"))
+    if tournamentstartdate_gte:
+        tournamentstartdate_gte = datetime.strptime(tournamentstartdate_gte, "%Y-%m-%d")
+        query = query.where(Tournament.tournamentstartdate >= tournamentstartdate_gte)
+    if tournamentstartdate_lte:
+        tournamentstartdate_lte = datetime.strptime(tournamentstartdate_lte, "%Y-%m-%d")
+        query = query.where(Tournament.tournamentstartdate <= tournamentstartdate_lte)
+    if tournamentenddate_gte:
+        tournamentenddate_gte = datetime.strptime(tournamentenddate_gte, "%Y-%m-%d")
+        query = query.where(Tournament.tournamentenddate >= tournamentenddate_gte)
+    if tournamentenddate_lte:
+        tournamentenddate_lte = datetime.strptime(tournamentenddate_lte, "%Y-%m-%d")
+        query = query.where(Tournament.tournamentenddate <= tournamentenddate_lte)
+    if tournamenttype:
+        query = query.where(Tournament.tournamenttype.ilike(f"%{tournamenttype}%"))
+    if tournamentstyle:
+        query = query.where(Tournament.tournamentstyle.ilike(f"%{tournamentstyle}%"))
+    if tournamentstatus:
+        query = query.where(Tournament.tournamentstatus.ilike(f"%{tournamentstatus}%"))
+    return query
+
+# Relations that can be expanded: related model, column of the listed model, column of the related one
+TOURNAMENT_RELATIONS = {
+    "organizer": (Member, "tournamentorganizerid", "naf_number"),
+    "variant": (Variant, "variantsid", "variantid"),
+}
+
+@app.get("/tournaments",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Tournaments"],)
+async def get_tournaments(
+    request: Request,
+    query: Select = Depends(tournaments_query),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of items to return"),
+    cursor: str = Query(None, description="Cursor returned as `next` by the previous page"),
+    fields: str = Query(None, description="Comma separated columns to return, `relation.column` for the columns of the expanded relations"),
+    expand: str = Query(None, description="Comma separated relations to return within every item: organizer, variant"),
     db: AsyncSession = Depends(get_async_db),
 ):
+    keys = (Tournament.tournamentid,)
+    cursor = decode_cursor(cursor, keys)
+    query, expand = project(query, keys, fields, expand, TOURNAMENT_RELATIONS)
     try:
-        query = select(Tournament)
-        if tournamentid:
-            query = query.where(Tournament.tournamentid == tournamentid)
-        if tournamentorganizerid:
-            query = query.where(Tournament.tournamentorganizerid == tournamentorganizerid)
-        if tournamentname:
-            query = query.where(Tournament.tournamentname.ilike(f"%{tournamentname}%"))
-        if tournamentcity:
-            query = query.where(Tournament.tournamentcity.ilike(f"%{tournamentcity}%"))
-        if tournamentstate:
-            query = query.where(Tournament.tournamentstate.ilike(f"%{tournamentstate}%"))
-        if tournamentnation:
-            query = query.where(Tournament.tournamentnation.ilike(f"%{tournamentnation}%"))
-        if tournamentstartdate_gte:
-            tournamentstartdate_gte = datetime.strptime(tournamentstartdate_gte, "%Y-%m-%d")
-            query = query.where(Tournament.tournamentstartdate >= tournamentstartdate_gte)
-        if tournamentstartdate_lte:
-            tournamentstartdate_lte = datetime.strptime(tournamentstartdate_lte, "%Y-%m-%d")
-            query = query.where(Tournament.tournamentstartdate <= tournamentstartdate_lte)
-        if tournamentenddate_gte:
-            tournamentenddate_gte = datetime.strptime(tournamentenddate_gte, "%Y-%m-%d")
-            query = query.where(Tournament.tournamentenddate >= tournamentenddate_gte)
-        if tournamentenddate_lte:
-            tournamentenddate_lte = datetime.strptime(tournamentenddate_lte, "%Y-%m-%d")
-            query = query.where(Tournament.tournamentenddate <= tournamentenddate_lte)
-        if tournamenttype:
-            query = query.where(Tournament.tournamenttype.ilike(f"%{tournamenttype}%"))
-        if tournamentstyle:
-            query = query.where(Tournament.tournamentstyle.ilike(f"%{tournamentstyle}%"))
-        if tournamentstatus:
-            query = query.where(Tournament.tournamentstatus.ilike(f"%{tournamentstatus}%"))
-        
-        result = await db.execute(query)
-        tournaments = result.scalars().all()
+        result = await db.execute(paginate(query, keys, cursor, limit))
+        tournaments = nest(as_dicts(result), expand)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    return tournaments
+    return ORJSONResponse(page(tournaments, keys, limit))
 
-@app.get("/games",
+@app.get("/tournaments/batch",
             responses={200: {"content": {"application/json": {},}}},
-            tags=["Games"],)
-async def get_games(
+            tags=["Tournaments"],)
+async def get_tournaments_batch(
+    ids: list[int] = Query(..., description="Tournament IDs to look up, repeated (`ids=1&ids=2`) and returned in that order"),
+    fields: str = Query(None, description="Comma separated columns to return, `relation.column` for the columns of the expanded relations"),
+    expand: str = Query(None, description="Comma separated relations to return within every item: organizer, variant"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await batch_lookup(db, Tournament, Tournament.tournamentid, ids, fields, expand, TOURNAMENT_RELATIONS)
+
+@app.post("/tournaments/batch",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Tournaments"],)
+async def post_tournaments_batch(
+    ids: list[int] = Body(..., embed=True, description="Tournament IDs to look up, returned in that order"),
+    fields: str = Query(None, description="Comma separated columns to return, `relation.column` for the columns of the expanded relations"),
+    expand: str = Query(None, description="Comma separated relations to return within every item: organizer, variant"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await batch_lookup(db, Tournament, Tournament.tournamentid, ids, fields, expand, TOURNAMENT_RELATIONS)
+
+@app.get("/tournaments/search",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Tournaments"],)
+async def search_tournaments(
     request: Request,
+    q: str = Query(..., min_length=2, description="Words to look for in the name, information, report and scoring of the tournaments"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of tournaments to return"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    try:
+        document = func.concat_ws(" ", Tournament.tournamentinformation, Tournament.tournamentreport, Tournament.tournamentscoring)
+        tournaments = await full_text_search(db, (Tournament.tournamentid, Tournament.tournamentname, Tournament.tournamentstartdate, Tournament.tournamentnation), (Tournament.tournamentid,), Tournament.search_vector, document, q, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return ORJSONResponse({"items": tournaments})
+
+@app.get("/tournaments/{tournamentid}/standings",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Tournaments"],)
+async def get_tournament_standings(
+    tournamentid: int = Path(..., description="The ID of the tournament"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Precomputed by the fetcher after every load from the games, the registrations and the awards of the tournament
+    try:
+        result = await db.execute(
+            select(*columns(TournamentStanding), Member.naf_name)
+            .outerjoin(Member, TournamentStanding.coachid == Member.naf_number)
+            .where(TournamentStanding.tournamentid == tournamentid)
+            .order_by(TournamentStanding.position, TournamentStanding.coachid)
+        )
+        standings = as_dicts(result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if not standings:
+        raise HTTPException(status_code=404, detail="No standings found for this tournament")
+    return ORJSONResponse({"tournamentid": tournamentid, "items": standings})
+
+
+def games_query(
     gameid: int = Query(None),
     seasonid: int = Query(None),
     tournamentid: int = Query(None),
@@ -289,100 +618,230 @@ async def get_games(
     newdate_lte: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$"),
     variantsid: int = Query(None),
     variant_name: str = Query(None, description="Filter by variant name"),
+    lookups: LookupTables = Depends(get_lookups),
+):
+    query = select(*columns(Game))
+    if gameid:
+        query = query.where(Game.gameid == gameid)
+    if seasonid:
+        query = query.where(Game.seasonid == seasonid)
+    if tournamentid:
+        query = query.where(Game.tournamentid == tournamentid)
+    if homecoachid:
+        query = query.where(Game.homecoachid == homecoachid)
+    if awaycoachid:
+        query = query.where(Game.awaycoachid == awaycoachid)
+    if racehome:
+        query = query.where(Game.racehome == racehome)
+    if raceaway:
+        query = query.where(Game.raceaway == raceaway)
+    # Either side filters are semi joins with game_participants, every game is returned once
+    if race_name:
+        query = query.where(Game.gameid.in_(select(GameParticipant.gameid).where(GameParticipant.raceid.in_(lookups.race_ids(race_name)))))
+    if coach_name:
+        query = query.where(Game.gameid.in_(
+            select(GameParticipant.gameid).join(Member, GameParticipant.coachid == Member.naf_number).where(Member.naf_name.ilike(f"%{coach_name}%"))
+        ))
+    if race_id:
+        query = query.where(Game.gameid.in_(select(GameParticipant.gameid).where(GameParticipant.raceid == race_id)))
+    if coach_id:
+        query = query.where(Game.gameid.in_(select(GameParticipant.gameid).where(GameParticipant.coachid == coach_id)))
+    if trhome:
+        query = query.where(Game.trhome == trhome)
+    if traway:
+        query = query.where(Game.traway == traway)
+    if rephome:
+        query = query.where(Game.rephome == rephome)
+    if repaway:
+        query = query.where(Game.repaway == repaway)
+    if rephome_calibrated:
+        query = query.where(Game.rephome_calibrated == rephome_calibrated)
+    if repaway_calibrated:
+        query = query.where(Game.repaway_calibrated == repaway_calibrated)
+    if dirty_calibrated is not None:
+        query = query.where(Game.dirty_calibrated == dirty_calibrated)
+    if goalshome:
+        query = query.where(Game.goalshome == goalshome)
+    if goalsaway:
+        query = query.where(Game.goalsaway == goalsaway)
+    if badlyhurthome:
+        query = query.where(Game.badlyhurthome == badlyhurthome)
+    if badlyhurtaway:
+        query = query.where(Game.badlyhurtaway == badlyhurtaway)
+    if serioushome:
+        query = query.where(Game.serioushome == serioushome)
+    if seriousaway:
+        query = query.where(Game.seriousaway == seriousaway)
+    if killshome:
+        query = query.where(Game.killshome == killshome)
+    if killsaway:
+        query = query.where(Game.killsaway == killsaway)
+    if gate:
+        query = query.where(Game.gate == gate)
+    if winningshome:
+        query = query.where(Game.winningshome == winningshome)
+    if winningsaway:
+        query = query.where(Game.winningsaway == winningsaway)
+    if date_gte:
+        date_gte = datetime.strptime(date_gte, "%Y-%m-%d")
+        query = query.where(Game.date >= date_gte)
+    if date_lte:
+        date_lte = datetime.strptime(date_lte, "%Y-%m-%d")
+        query = query.where(Game.date <= date_lte)
+    if dirty is not None:
+        query = query.where(Game.dirty == dirty)
+    if hour:
+        query = query.where(Game.hour == hour)
+    if newdate_gte:
+        newdate_gte = datetime.strptime(newdate_gte, "%Y-%m-%d")
+        query = query.where(Game.newdate >= newdate_gte)
+    if newdate_lte:
+        newdate_lte = datetime.strptime(newdate_lte, "%Y-%m-%d")
+        query = query.where(Game.newdate <= newdate_lte)
+    if variantsid:
+        query = query.where(Game.variantsid == variantsid)
+    if variant_name:
+        query = query.where(Game.variantsid.in_(lookups.variant_ids(variant_name)))
+    return query
+
+GAME_RELATIONS = {
+    "homecoach": (Member, "homecoachid", "naf_number"),
+    "awaycoach": (Member, "awaycoachid", "naf_number"),
+    "racehome": (Race, "racehome", "raceid"),
+    "raceaway": (Race, "raceaway", "raceid"),
+    "tournament": (Tournament, "tournamentid", "tournamentid"),
+    "variant": (Variant, "variantsid", "variantid"),
+}
+
+@app.get("/games",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Games"],)
+async def get_games(
+    request: Request,
+    query: Select = Depends(games_query),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of items to return"),
+    cursor: str = Query(None, description="Cursor returned as `next` by the previous page"),
+    fields: str = Query(None, description="Comma separated columns to return, `relation.column` for the columns of the expanded relations"),
+    expand: str = Query(None, description="Comma separated relations to return within every item: homecoach, awaycoach, racehome, raceaway, tournament, variant"),
     db: AsyncSession = Depends(get_async_db),
 ):
+    keys = (Game.gameid,)
+    cursor = decode_cursor(cursor, keys)
+    query, expand = project(query, keys, fields, expand, GAME_RELATIONS)
     try:
-        query = select(Game)
-        if gameid:
-            query = query.where(Game.gameid == gameid)
-        if seasonid:
-            query = query.where(Game.seasonid == seasonid)
-        if tournamentid:
-            query = query.where(Game.tournamentid == tournamentid)
-        if homecoachid:
-            query = query.where(Game.homecoachid == homecoachid)
-        if awaycoachid:
-            query = query.where(Game.awaycoachid == awaycoachid)
-        if racehome:
-            query = query.where(Game.racehome == racehome)
-        if raceaway:
-            query = query.where(Game.raceaway == raceaway)
-        if race_name:
-            query = query.join(Race, (Game.racehome == Race.raceid) | (Game.raceaway == Race.raceid)).where(Race.name.ilike(f"%{race_name}%"))
-        if coach_name:
-            query = query.join(Member, (Game.homecoachid == Member.naf_number) | (Game.awaycoachid == Member.naf_number)).where(Member.naf_name.ilike(f"%{coach_name}%"))
-        if race_id:
-            query = query.where((Game.racehome == race_id) | (Game.raceaway == race_id))
-        if coach_id:
-            query = query.where((Game.homecoachid == coach_id) | (Game.awaycoachid == coach_id))
-        if trhome:
-            query = query.where(Game.trhome == trhome)
-        if traway:
-            query = query.where(Game.traway == traway)
-        if rephome:
-            query = query.where(Game.rephome == rephome)
-        if repaway:
-            query = query.where(Game.repaway == repaway)
-        if rephome_calibrated:
-            query = query.where(Game.rephome_calibrated == rephome_calibrated)
-        if repaway_calibrated:
-            query = query.where(Game.repaway_calibrated == repaway_calibrated)
-        if dirty_calibrated is not None:
-            query = query.where(Game.dirty_calibrated == dirty_calibrated)
-        if goalshome:
-            query = query.where(Game.goalshome == goalshome)
-        if goalsaway:
-            query = query.where(Game.goalsaway == goalsaway)
-        if badlyhurthome:
-            query = query.where(Game.badlyhurthome == badlyhurthome)
-        if badlyhurtaway:
-            query = query.where(Game.badlyhurtaway == badlyhurtaway)
-        if serioushome:
-            query = query.where(Game.serioushome == serioushome)
-        if seriousaway:
-            query = query.where(Game.seriousaway == seriousaway)
-        if killshome:
-            query = query.where(Game.killshome == killshome)
-        if killsaway:
-            query = query.where(Game.killsaway == killsaway)
-        if gate:
-            query = query.where(Game.gate == gate)
-        if winningshome:
-            query = query.where(Game.winningshome == winningshome)
-        if winningsaway:
-            query = query.where(Game.winningsaway == winningsaway)
-        if date_gte:
-            date_gte = datetime.strptime(date_gte, "%Y-%m-%d")
-            query = query.where(Game.date >= date_gte)
-        if date_lte:
-            date_lte = datetime.strptime(date_lte, "%Y-%m-%d")
-            query = query.where(Game.date <= date_lte)
-        if dirty is not None:
-            query = query.where(Game.dirty == dirty)
-        if hour:
-            query = query.where(Game.hour == hour)
-        if newdate_gte:
-            newdate_gte = datetime.strptime(newdate_gte, "%Y-%m-%d")
-            query = query.where(Game.newdate >= newdate_gte)
-        if newdate_lte:
-            newdate_lte = datetime.strptime(newdate_lte, "%Y-%m-%d")
-            query = query.where(Game.newdate <= newdate_lte)
-        if variantsid:
-            query = query.where(Game.variantsid == variantsid)
-        if variant_name:
-            query = query.join(Variant, Game.variantsid == Variant.variantid).where(Variant.variantname.ilike(f"%{variant_name}%"))
-        
-        result = await db.execute(query)
-        games = result.scalars().all()
+        result = await db.execute(paginate(query, keys, cursor, limit))
+        games = nest(as_dicts(result), expand)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    return games
+    return ORJSONResponse(page(games, keys, limit))
 
-@app.get("/awards",
+@app.get("/games/batch",
             responses={200: {"content": {"application/json": {},}}},
-            tags=["Awards"],)
-async def get_awards(
+            tags=["Games"],)
+async def get_games_batch(
+    ids: list[int] = Query(..., description="Game IDs to look up, repeated (`ids=1&ids=2`) and returned in that order"),
+    fields: str = Query(None, description="Comma separated columns to return, `relation.column` for the columns of the expanded relations"),
+    expand: str = Query(None, description="Comma separated relations to return within every item: homecoach, awaycoach, racehome, raceaway, tournament, variant"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await batch_lookup(db, Game, Game.gameid, ids, fields, expand, GAME_RELATIONS)
+
+@app.post("/games/batch",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Games"],)
+async def post_games_batch(
+    ids: list[int] = Body(..., embed=True, description="Game IDs to look up, returned in that order"),
+    fields: str = Query(None, description="Comma separated columns to return, `relation.column` for the columns of the expanded relations"),
+    expand: str = Query(None, description="Comma separated relations to return within every item: homecoach, awaycoach, racehome, raceaway, tournament, variant"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await batch_lookup(db, Game, Game.gameid, ids, fields, expand, GAME_RELATIONS)
+
+# Every game is unnested into its home and away teams, home first
+GAME_SIDES = {
+    "coach": (Game.homecoachid, Game.awaycoachid),
+    "race": (Game.racehome, Game.raceaway),
+    "goals": (Game.goalshome, Game.goalsaway),
+    "casualties": (
+        func.coalesce(Game.badlyhurthome, 0) + func.coalesce(Game.serioushome, 0) + func.coalesce(Game.killshome, 0),
+        func.coalesce(Game.badlyhurtaway, 0) + func.coalesce(Game.seriousaway, 0) + func.coalesce(Game.killsaway, 0),
+    ),
+    "kills": (Game.killshome, Game.killsaway),
+    "winnings": (Game.winningshome, Game.winningsaway),
+}
+
+AGGREGATE_DIMENSIONS = {
+    "race": lambda sides: sides.c.race,
+    "coach": lambda sides: sides.c.coach,
+    "variant": lambda sides: sides.c.variantsid,
+    "tournament": lambda sides: sides.c.tournamentid,
+    "year": lambda sides: func.extract("year", sides.c.date).cast(Integer),
+    "month": lambda sides: func.to_char(sides.c.date, "YYYY-MM"),
+}
+
+AGGREGATE_METRICS = {"count": lambda sides: func.count(sides.c.gameid.distinct())}
+for value in ("goals", "casualties", "kills", "winnings"):
+    AGGREGATE_METRICS[f"sum_{value}"] = lambda sides, value=value: func.sum(sides.c[value])
+    AGGREGATE_METRICS[f"avg_{value}"] = lambda sides, value=value: func.avg(sides.c[value]).cast(Float)
+
+@app.get("/games/aggregate",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Games"],)
+async def get_games_aggregate(
+    query: Select = Depends(games_query),
+    group_by: str = Query(None, description="Comma separated dimensions: race, coach, variant, tournament, year, month"),
+    metrics: str = Query("count", description="Comma separated metrics: count, sum_goals, avg_goals, sum_casualties, avg_casualties, sum_kills, avg_kills, sum_winnings, avg_winnings"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Grouped inside Postgres with a single GROUP BY over the filtered games.
+    # count is the number of games, the other metrics are per team: race and coach group the games by the teams that played them
+    group_by = split(group_by)
+    metrics = split(metrics)
+    unknown = [name for name in group_by if name not in AGGREGATE_DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown dimensions: {', '.join(unknown)}")
+    unknown = [name for name in metrics if name not in AGGREGATE_METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown metrics: {', '.join(unknown)}")
+    if not metrics:
+        raise HTTPException(status_code=400, detail="No metrics given")
+    group_by = list(dict.fromkeys(group_by))
+    sides = query.with_only_columns(
+        Game.gameid,
+        Game.variantsid,
+        Game.tournamentid,
+        Game.date,
+        *[func.unnest(array(pair)).label(name) for name, pair in GAME_SIDES.items()],
+    ).subquery()
+    dimensions = [AGGREGATE_DIMENSIONS[name](sides).label(name) for name in group_by]
+    aggregate = select(*dimensions, *[AGGREGATE_METRICS[name](sides).label(name) for name in dict.fromkeys(metrics)]).select_from(sides)
+    if dimensions:
+        aggregate = aggregate.group_by(*dimensions).order_by(*dimensions)
+    try:
+        result = await db.execute(aggregate.limit(AGGREGATE_MAX_GROUPS + 1))
+        groups = as_dicts(result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if len(groups) > AGGREGATE_MAX_GROUPS:
+        raise HTTPException(status_code=400, detail=f"More than {AGGREGATE_MAX_GROUPS} groups, narrow the filters or the dimensions")
+    return ORJSONResponse({"items": groups})
+
+@app.get("/games/search",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Games"],)
+async def search_games(
     request: Request,
+    q: str = Query(..., min_length=2, description="Words to look for in the notes of the games"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of games to return"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    try:
+        games = await full_text_search(db, (Game.gameid, Game.tournamentid, Game.homecoachid, Game.awaycoachid, Game.date), (Game.gameid,), Game.notes_vector, Game.notes, q, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return ORJSONResponse({"items": games})
+
+def awards_query(
     typeid: int = Query(None, description="Filter by award type ID"),
     tournamentid: int = Query(None, description="Filter by tournament ID"),
     coachid: int = Query(None, description="Filter by coach ID"),
@@ -392,42 +851,76 @@ async def get_awards(
     award_name: str = Query(None, description="Filter by award name"),
     date_gte: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$", description="Filter by start date (greater than or equal to)"),
     date_lte: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$", description="Filter by end date (less than or equal to)"),
+    lookups: LookupTables = Depends(get_lookups),
+):
+    query = select(*columns(TournamentStatistic)).join(Member, TournamentStatistic.coachid == Member.naf_number)
+    if typeid:
+        query = query.where(TournamentStatistic.typeid == typeid)
+    if tournamentid:
+        query = query.where(TournamentStatistic.tournamentid == tournamentid)
+    if coachid:
+        query = query.where(TournamentStatistic.coachid == coachid)
+    if coach_name:
+        query = query.where(Member.naf_name.ilike(f"%{coach_name}%"))
+    if raceid:
+        query = query.where(TournamentStatistic.raceid == raceid)
+    if notes:
+        query = query.where(TournamentStatistic.notes.ilike(f"%{notes}%"))
+    if award_name:
+        query = query.where(TournamentStatistic.typeid.in_(lookups.award_ids(award_name)))
+    if date_gte:
+        date_gte = datetime.strptime(date_gte, "%Y-%m-%d")
+        query = query.where(TournamentStatistic.date >= date_gte)
+    if date_lte:
+        date_lte = datetime.strptime(date_lte, "%Y-%m-%d")
+        query = query.where(TournamentStatistic.date <= date_lte)
+    return query
+
+AWARD_RELATIONS = {
+    "award": (Award, "typeid", "id"),
+    "coach": (Member, "coachid", "naf_number"),
+    "race": (Race, "raceid", "raceid"),
+    "tournament": (Tournament, "tournamentid", "tournamentid"),
+}
+
+@app.get("/awards",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Awards"],)
+async def get_awards(
+    request: Request,
+    query: Select = Depends(awards_query),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of items to return"),
+    cursor: str = Query(None, description="Cursor returned as `next` by the previous page"),
+    fields: str = Query(None, description="Comma separated columns to return, `relation.column` for the columns of the expanded relations"),
+    expand: str = Query(None, description="Comma separated relations to return within every item: award, coach, race, tournament"),
     db: AsyncSession = Depends(get_async_db),
 ):
+    keys = (TournamentStatistic.typeid, TournamentStatistic.tournamentid, TournamentStatistic.coachid)
+    cursor = decode_cursor(cursor, keys)
+    query, expand = project(query, keys, fields, expand, AWARD_RELATIONS)
     try:
-        query = select(TournamentStatistic).join(Member, TournamentStatistic.coachid == Member.naf_number)
-        if typeid:
-            query = query.where(TournamentStatistic.typeid == typeid)
-        if tournamentid:
-            query = query.where(TournamentStatistic.tournamentid == tournamentid)
-        if coachid:
-            query = query.where(TournamentStatistic.coachid == coachid)
-        if coach_name:
-            query = query.where(Member.naf_name.ilike(f"%{coach_name}%"))
-        if raceid:
-            query = query.where(TournamentStatistic.raceid == raceid)
-        if notes:
-            query = query.where(TournamentStatistic.notes.ilike(f"%{notes}%"))
-        if award_name:            
-            query = query.join(Award, (TournamentStatistic.typeid == Award.id)).where(Award.name.ilike(f"%{award_name}%"))
-        if date_gte:
-            date_gte = datetime.strptime(date_gte, "%Y-%m-%d")
-            query = query.where(TournamentStatistic.date >= date_gte)
-        if date_lte:
-            date_lte = datetime.strptime(date_lte, "%Y-%m-%d")
-            query = query.where(TournamentStatistic.date <= date_lte)
-        
-        result = await db.execute(query)
-        awards = result.scalars().all()
+        result = await db.execute(paginate(query, keys, cursor, limit))
+        awards = nest(as_dicts(result), expand)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    return awards
+    return ORJSONResponse(page(awards, keys, limit))
 
-@app.get("/rankings",
+@app.get("/awards/search",
             responses={200: {"content": {"application/json": {},}}},
-            tags=["Rankings"],)
-async def get_rankings(
+            tags=["Awards"],)
+async def search_awards(
     request: Request,
+    q: str = Query(..., min_length=2, description="Words to look for in the notes of the awards"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of awards to return"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    try:
+        awards = await full_text_search(db, (TournamentStatistic.typeid, TournamentStatistic.tournamentid, TournamentStatistic.coachid, TournamentStatistic.date), (TournamentStatistic.typeid, TournamentStatistic.tournamentid, TournamentStatistic.coachid), TournamentStatistic.notes_vector, TournamentStatistic.notes, q, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return ORJSONResponse({"items": awards})
+
+def rankings_query(
     coachid: int = Query(None, description="Filter by coach ID"),
     raceid: int = Query(None, description="Filter by race ID"),
     variantid: int = Query(None, description="Filter by variant ID"),
@@ -435,66 +928,307 @@ async def get_rankings(
     coach_name: str = Query(None, description="Filter by coach name"),
     variant_name: str = Query(None, description="Filter by variant name"),
     country: str = Query(None, description="Filter by coach country"),
-    ranking_gte: int = Query(None, description="Filter by ranking (greater than or equal to)"),
-    ranking_lte: int = Query(None, description="Filter by ranking (less than or equal to)"),
+    ranking_gte: float = Query(None, description="Filter by ranking (greater than or equal to)"),
+    ranking_lte: float = Query(None, description="Filter by ranking (less than or equal to)"),
+    as_of: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$", description="Rankings as they were on this date, from the last snapshot taken on or before it"),
+    lookups: LookupTables = Depends(get_lookups),
+):
+    ranking = CoachRankingVariant
+    if as_of:
+        ranking = RankingSnapshot
+    query = select(*columns(ranking))
+    if coach_name or country:
+        query = query.join(Member, ranking.coachid == Member.naf_number)
+    if as_of:
+        # The snapshot date is a parameter known when the query starts, the other partitions are pruned
+        snapshot_date = select(func.max(RankingSnapshot.snapshot_date)).where(RankingSnapshot.snapshot_date <= datetime.strptime(as_of, "%Y-%m-%d").date()).scalar_subquery()
+        query = query.where(RankingSnapshot.snapshot_date == snapshot_date)
+    if coachid:
+        query = query.where(ranking.coachid == coachid)
+    if raceid:
+        query = query.where(ranking.raceid == raceid)
+    if variantid:
+        query = query.where(ranking.variantid == variantid)
+    if race_name:
+        query = query.where(ranking.raceid.in_(lookups.race_ids(race_name)))
+    if coach_name:
+        query = query.where(Member.naf_name.ilike(f"%{coach_name}%"))
+    if variant_name:
+        query = query.where(ranking.variantid.in_(lookups.variant_ids(variant_name)))
+    if country:
+        query = query.where(Member.country.ilike(f"%{country}%"))
+    if ranking_gte is not None:
+        query = query.where(ranking.ranking >= ranking_gte)
+    if ranking_lte is not None:
+        query = query.where(ranking.ranking <= ranking_lte)
+    return query
+
+def ranking_keys(query):
+    # Current rankings or a snapshot, depending on as_of
+    ranking = query.column_descriptions[0]["entity"]
+    return (ranking.coachid, ranking.raceid, ranking.variantid)
+
+RANKING_RELATIONS = {
+    "coach": (Member, "coachid", "naf_number"),
+    "race": (Race, "raceid", "raceid"),
+    "variant": (Variant, "variantid", "variantid"),
+}
+
+@app.get("/rankings",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Rankings"],)
+async def get_rankings(
+    request: Request,
+    query: Select = Depends(rankings_query),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of items to return"),
+    cursor: str = Query(None, description="Cursor returned as `next` by the previous page"),
+    fields: str = Query(None, description="Comma separated columns to return, `relation.column` for the columns of the expanded relations"),
+    expand: str = Query(None, description="Comma separated relations to return within every item: coach, race, variant"),
     db: AsyncSession = Depends(get_async_db),
 ):
+    keys = ranking_keys(query)
+    cursor = decode_cursor(cursor, keys)
+    query, expand = project(query, keys, fields, expand, RANKING_RELATIONS)
+    try:
+        result = await db.execute(paginate(query, keys, cursor, limit))
+        rankings = nest(as_dicts(result), expand)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return ORJSONResponse(page(rankings, keys, limit))
+
+@app.get("/rankings/leaderboard",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Rankings"],)
+async def get_rankings_leaderboard(
+    variantid: int = Query(..., description="Variant of the rankings, rankings of different variants are not compared"),
+    raceid: int = Query(None, description="Rank among the coaches of this race, all the races of the variant by default"),
+    country: str = Query(None, description="Filter by coach country, the positions stay those among all the coaches"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Maximum number of items to return"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Positions are precomputed by the fetcher after every load, the top of a race or variant is a range of its position index
+    if raceid is not None:
+        position, percentile = RankingPosition.race_position, RankingPosition.race_percentile
+    else:
+        position, percentile = RankingPosition.variant_position, RankingPosition.variant_percentile
+    query = select(
+        RankingPosition.coachid,
+        RankingPosition.naf_name,
+        RankingPosition.country,
+        RankingPosition.raceid,
+        RankingPosition.variantid,
+        RankingPosition.ranking,
+        position.label("position"),
+        percentile.label("percentile"),
+    ).where(RankingPosition.variantid == variantid)
+    if raceid is not None:
+        query = query.where(RankingPosition.raceid == raceid)
+    if country:
+        query = query.where(RankingPosition.country.ilike(f"%{country}%"))
+    try:
+        result = await db.execute(query.order_by(position, RankingPosition.raceid, RankingPosition.coachid).limit(limit))
+        leaderboard = as_dicts(result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return ORJSONResponse({"items": leaderboard})
+
+@app.get("/rankings/history",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Rankings"],)
+async def get_rankings_history(
+    coachid: int = Query(..., description="Filter by coach ID"),
+    raceid: int = Query(None, description="Filter by race ID"),
+    variantid: int = Query(None, description="Filter by variant ID"),
+    date_gte: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$", description="Filter snapshots taken on or after this date"),
+    date_lte: str = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$", description="Filter snapshots taken on or before this date"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # Daily snapshots of the rankings kept by the fetcher
+    try:
+        query = select(*columns(RankingSnapshot)).where(RankingSnapshot.coachid == coachid)
+        if raceid is not None:
+            query = query.where(RankingSnapshot.raceid == raceid)
+        if variantid is not None:
+            query = query.where(RankingSnapshot.variantid == variantid)
+        if date_gte:
+            query = query.where(RankingSnapshot.snapshot_date >= datetime.strptime(date_gte, "%Y-%m-%d").date())
+        if date_lte:
+            query = query.where(RankingSnapshot.snapshot_date <= datetime.strptime(date_lte, "%Y-%m-%d").date())
+        result = await db.execute(query.order_by(RankingSnapshot.raceid, RankingSnapshot.variantid, RankingSnapshot.snapshot_date))
+        snapshots = as_dicts(result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return ORJSONResponse({"items": snapshots})
+
+@app.get("/stats/races/matchups",
+            responses={200: {"content": {"application/json": {},}}},
+            tags=["Statistics"],)
+async def get_race_matchups(
+    variant_id: int = Query(None, description="Filter games by variant ID"),
+    year_gte: int = Query(None, ge=1900, le=2999, description="Filter games played in this year or later"),
+    year_lte: int = Query(None, ge=1900, le=2999, description="Filter games played in this year or earlier"),
+    race_id: int = Query(None, description="Filter the matchups of this race, home or away"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # The matchups are stored by variant and year, the requested ones are added up
+    games = func.sum(RaceMatchup.games)
+    query = select(
+        RaceMatchup.racehome,
+        RaceMatchup.raceaway,
+        games.label("games"),
+        func.sum(RaceMatchup.home_wins).label("home_wins"),
+        func.sum(RaceMatchup.draws).label("draws"),
+        func.sum(RaceMatchup.away_wins).label("away_wins"),
+        (func.sum(RaceMatchup.td_home) / games.cast(Float)).label("avg_td_home"),
+        (func.sum(RaceMatchup.td_away) / games.cast(Float)).label("avg_td_away"),
+        (func.sum(RaceMatchup.cas_home) / games.cast(Float)).label("avg_cas_home"),
+        (func.sum(RaceMatchup.cas_away) / games.cast(Float)).label("avg_cas_away"),
+    ).group_by(RaceMatchup.racehome, RaceMatchup.raceaway).order_by(RaceMatchup.racehome, RaceMatchup.raceaway)
+    if variant_id is not None:
+        query = query.where(RaceMatchup.variantid == variant_id)
+    if year_gte is not None:
+        query = query.where(RaceMatchup.year >= year_gte)
+    if year_lte is not None:
+        query = query.where(RaceMatchup.year <= year_lte)
+    if race_id is not None:
+        query = query.where((RaceMatchup.racehome == race_id) | (RaceMatchup.raceaway == race_id))
     try:
-        query = select(CoachRankingVariant).join(Member, CoachRankingVariant.coachid == Member.naf_number).join(Race, CoachRankingVariant.raceid == Race.raceid).join(Variant, CoachRankingVariant.variantid == Variant.variantid)
-        if coachid:
-            query = query.where(CoachRankingVariant.coachid == coachid)
-        if raceid:
-            query = query.where(CoachRankingVariant.raceid == raceid)
-        if variantid:
-            query = query.where(CoachRankingVariant.variantid == variantid)
-        if race_name:
-            query = query.where(Race.name.ilike(f"%{race_name}%"))
-        if coach_name:
-            query = query.where(Member.naf_name.ilike(f"%{coach_name}%"))
-        if variant_name:
-            query = query.where(Variant.variantname.ilike(f"%{variant_name}%"))
-        if country:
-            query = query.where(Member.country.ilike(f"%{country}%"))
-        if ranking_gte is not None:
-            query = query.where(CoachRankingVariant.ranking >= ranking_gte)
-        if ranking_lte is not None:
-            query = query.where(CoachRankingVariant.ranking <= ranking_lte)
-        
         result = await db.execute(query)
-        rankings = result.scalars().all()
+        matchups = result.mappings().all()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    return rankings
+    return ORJSONResponse({"items": matchups})
 
-@app.get("/common/races",
+def like_prefix(value):
+    # Escape the LIKE wildcards of the user input
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+@app.get("/search",
         responses={200: {"content": {"application/json": {},}}},
-        tags=["Common Data"],)
-async def get_races(
+        tags=["Search"],)
+async def search(
     request: Request,
+    q: str = Query(..., min_length=2, description="Name of the coach or tournament, typos are tolerated"),
+    limit: int = Query(10, ge=1, le=100, description="Maximum number of coaches and of tournaments to return"),
     db: AsyncSession = Depends(get_async_db),
 ):
     try:
-        query = select(Race)
-        result = await db.execute(query)
-        races = result.scalars().all()
+        # Word similarity (<%) is served by the trigram indexes, names starting with q rank first
+        await db.execute(select(func.set_config("pg_trgm.word_similarity_threshold", SEARCH_SIMILARITY, True)))
+        members_score = func.word_similarity(q, Member.naf_name)
+        members = await db.execute(
+            select(Member.naf_number, Member.naf_name, Member.country, members_score.label("score"))
+            .where(literal(q).op("<%")(Member.naf_name))
+            .order_by(Member.naf_name.ilike(like_prefix(q)).desc(), members_score.desc(), Member.naf_number)
+            .limit(limit)
+        )
+        tournaments_score = func.word_similarity(q, Tournament.tournamentname)
+        tournaments = await db.execute(
+            select(Tournament.tournamentid, Tournament.tournamentname, Tournament.tournamentcity, Tournament.tournamentnation, Tournament.tournamentstartdate, tournaments_score.label("score"))
+            .where(literal(q).op("<%")(Tournament.tournamentname))
+            .order_by(Tournament.tournamentname.ilike(like_prefix(q)).desc(), tournaments_score.desc(), Tournament.tournamentid)
+            .limit(limit)
+        )
+        result = {"members": members.mappings().all(), "tournaments": tournaments.mappings().all()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    return races
+    return ORJSONResponse(result)
 
-@app.get("/common/variants",
+@app.get("/search/autocomplete",
         responses={200: {"content": {"application/json": {},}}},
-        tags=["Common Data"],)
-async def get_variants(
+        tags=["Search"],)
+async def autocomplete(
     request: Request,
+    q: str = Query(..., min_length=2, description="Beginning of the name of the coach or tournament"),
+    limit: int = Query(10, ge=1, le=100, description="Maximum number of coaches and of tournaments to return"),
     db: AsyncSession = Depends(get_async_db),
 ):
     try:
-        query = select(Variant)
-        result = await db.execute(query)
-        variants = result.scalars().all()
+        # Range scans of the lower(name) COLLATE "C" indexes, already in the order of the results
+        prefix = like_prefix(q.lower())
+        member_name = func.lower(Member.naf_name).collate("C")
+        tournament_name = func.lower(Tournament.tournamentname).collate("C")
+        members = await db.execute(
+            select(Member.naf_number, Member.naf_name, Member.country)
+            .where(member_name.like(prefix))
+            .order_by(member_name)
+            .limit(limit)
+        )
+        tournaments = await db.execute(
+            select(Tournament.tournamentid, Tournament.tournamentname, Tournament.tournamentstartdate)
+            .where(tournament_name.like(prefix))
+            .order_by(tournament_name)
+            .limit(limit)
+        )
+        result = {"members": members.mappings().all(), "tournaments": tournaments.mappings().all()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    return variants
+    return ORJSONResponse(result)
+
+EXPORT_RESPONSES = {200: {"content": {"application/x-ndjson": {}, "text/csv": {}}}}
+
+@app.get("/export/members",
+        responses=EXPORT_RESPONSES,
+        tags=["Export"],)
+async def export_members(
+    query: Select = Depends(members_query),
+    format: str = Query("ndjson", regex=r"^(ndjson|csv)$", description="Output format"),
+):
+    return export_response(engine, query.order_by(Member.naf_number), format, "members")
+
+@app.get("/export/tournaments",
+        responses=EXPORT_RESPONSES,
+        tags=["Export"],)
+async def export_tournaments(
+    query: Select = Depends(tournaments_query),
+    format: str = Query("ndjson", regex=r"^(ndjson|csv)$", description="Output format"),
+):
+    return export_response(engine, query.order_by(Tournament.tournamentid), format, "tournaments")
+
+@app.get("/export/games",
+        responses=EXPORT_RESPONSES,
+        tags=["Export"],)
+async def export_games(
+    query: Select = Depends(games_query),
+    format: str = Query("ndjson", regex=r"^(ndjson|csv)$", description="Output format"),
+):
+    return export_response(engine, query.order_by(Game.gameid), format, "games")
+
+@app.get("/export/awards",
+        responses=EXPORT_RESPONSES,
+        tags=["Export"],)
+async def export_awards(
+    query: Select = Depends(awards_query),
+    format: str = Query("ndjson", regex=r"^(ndjson|csv)$", description="Output format"),
+):
+    return export_response(engine, query.order_by(TournamentStatistic.typeid, TournamentStatistic.tournamentid, TournamentStatistic.coachid), format, "awards")
+
+@app.get("/export/rankings",
+        responses=EXPORT_RESPONSES,
+        tags=["Export"],)
+async def export_rankings(
+    query: Select = Depends(rankings_query),
+    format: str = Query("ndjson", regex=r"^(ndjson|csv)$", description="Output format"),
+):
+    return export_response(engine, query.order_by(*ranking_keys(query)), format, "rankings")
+
+@app.get("/common/races",
+        responses={200: {"content": {"application/json": {},}}},
+        tags=["Common Data"],)
+async def get_races(
+    request: Request,
+    lookups: LookupTables = Depends(get_lookups),
+):
+    return ORJSONResponse(lookups.races)
+
+@app.get("/common/variants",
+        responses={200: {"content": {"application/json": {},}}},
+        tags=["Common Data"],)
+async def get_variants(
+    request: Request,
+    lookups: LookupTables = Depends(get_lookups),
+):
+    return ORJSONResponse(lookups.variants)
 
 
 @app.get("/common/awards",
@@ -502,12 +1236,6 @@ async def get_variants(
         tags=["Common Data"],)
 async def get_awards(
     request: Request,
-    db: AsyncSession = Depends(get_async_db),
+    lookups: LookupTables = Depends(get_lookups),
 ):
-    try:
-        query = select(Award)
-        result = await db.execute(query)
-        awards = result.scalars().all()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    return awards
+    return ORJSONResponse(lookups.awards)
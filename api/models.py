@@ -1,10 +1,17 @@
 from sqlalchemy.sql.expression import null
-from sqlalchemy import String,Boolean,Integer,Column,Text,DateTime,ForeignKey
+from sqlalchemy import String,Boolean,Integer,Column,Text,Date,DateTime,ForeignKey,ARRAY,Numeric,Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
 
+def columns(model):
+    # Selecting the columns instead of the model returns plain rows, no instances are built.
+    # The generated search columns are only matched against, they are not returned
+    return [getattr(model, column.key) for column in model.__table__.columns if column.computed is None]
+
+
 class Member(Base):
     __tablename__ = 'members'
     naf_number = Column(Integer, primary_key=True)
@@ -76,6 +83,13 @@ class Tournament(Base):
     variant_notes = Column(Text)
     variantstatus = Column(String(50))
     tournament_ruleset_file = Column(String(255))
+    search_vector = Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('english', coalesce(tournamentname, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(tournamentinformation, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(tournamentreport, '')), 'C') || "
+        "setweight(to_tsvector('english', coalesce(tournamentscoring, '')), 'D')",
+        persisted=True,
+    ))
 
 
 class TournamentStatistic(Base):
@@ -86,6 +100,7 @@ class TournamentStatistic(Base):
     raceid = Column(Integer, ForeignKey('races.raceid'))
     notes = Column(Text)
     date = Column(DateTime)
+    notes_vector = Column(TSVECTOR, Computed("to_tsvector('english', coalesce(notes, ''))", persisted=True))
 
 
 class TournamentCoach(Base):
@@ -128,6 +143,7 @@ class Game(Base):
     hour = Column(Integer)
     newdate = Column(DateTime)
     variantsid = Column(Integer, ForeignKey('variants.variantid'))
+    notes_vector = Column(TSVECTOR, Computed("to_tsvector('english', coalesce(notes, ''))", persisted=True))
 
 
 class CoachRankingVariant(Base):
@@ -136,5 +152,127 @@ class CoachRankingVariant(Base):
     raceid = Column(Integer, ForeignKey('races.raceid'), primary_key=True)
     variantid = Column(Integer, ForeignKey('variants.variantid'), primary_key=True)
     dateupdate = Column(DateTime)
-    ranking = Column(String(10))  # Adjusted to String to handle DECIMAL
-    ranking_temp = Column(String(10))  # Adjusted to String to handle DECIMAL
\ No newline at end of file
+    ranking = Column(Numeric(10, 2))
+    ranking_temp = Column(Numeric(10, 4))
+
+
+class GameParticipant(Base):
+    __tablename__ = 'game_participants'
+    coachid = Column(Integer, primary_key=True)
+    gameid = Column(Integer, primary_key=True)
+    side = Column(String(4))
+    raceid = Column(Integer)
+    opponentid = Column(Integer)
+    opponent_raceid = Column(Integer)
+    tournamentid = Column(Integer)
+    variantid = Column(Integer)
+    date = Column(Date)
+    td_for = Column(Integer)
+    td_against = Column(Integer)
+    cas_for = Column(Integer)
+    cas_against = Column(Integer)
+    result = Column(String(1))
+
+
+class CoachStat(Base):
+    __tablename__ = 'coach_stats'
+    coachid = Column(Integer, primary_key=True)
+    raceid = Column(Integer, primary_key=True)
+    variantid = Column(Integer, primary_key=True)
+    games = Column(Integer)
+    wins = Column(Integer)
+    draws = Column(Integer)
+    losses = Column(Integer)
+    td_for = Column(Integer)
+    td_against = Column(Integer)
+    cas_for = Column(Integer)
+    cas_against = Column(Integer)
+    first_game = Column(Date)
+    last_game = Column(Date)
+
+
+class TournamentStanding(Base):
+    __tablename__ = 'tournament_standings'
+    tournamentid = Column(Integer, primary_key=True)
+    coachid = Column(Integer, primary_key=True)
+    position = Column(Integer)
+    races = Column(ARRAY(Integer))
+    games = Column(Integer)
+    wins = Column(Integer)
+    draws = Column(Integer)
+    losses = Column(Integer)
+    td_for = Column(Integer)
+    td_against = Column(Integer)
+    td_diff = Column(Integer)
+    cas_for = Column(Integer)
+    cas_against = Column(Integer)
+    cas_diff = Column(Integer)
+    awards = Column(ARRAY(Integer))
+
+
+class HeadToHead(Base):
+    __tablename__ = 'head_to_head'
+    coach_a = Column(Integer, primary_key=True)
+    coach_b = Column(Integer, primary_key=True)
+    games = Column(Integer)
+    wins_a = Column(Integer)
+    draws = Column(Integer)
+    wins_b = Column(Integer)
+    td_a = Column(Integer)
+    td_b = Column(Integer)
+    races_a = Column(ARRAY(Integer))
+    races_b = Column(ARRAY(Integer))
+    first_game = Column(Date)
+    last_game = Column(Date)
+
+
+class RaceMatchup(Base):
+    __tablename__ = 'race_matchups'
+    variantid = Column(Integer, primary_key=True)
+    year = Column(Integer, primary_key=True)
+    racehome = Column(Integer, primary_key=True)
+    raceaway = Column(Integer, primary_key=True)
+    games = Column(Integer)
+    home_wins = Column(Integer)
+    draws = Column(Integer)
+    away_wins = Column(Integer)
+    td_home = Column(Integer)
+    td_away = Column(Integer)
+    cas_home = Column(Integer)
+    cas_away = Column(Integer)
+
+
+class RatingHistory(Base):
+    __tablename__ = 'rating_history'
+    coachid = Column(Integer, primary_key=True)
+    raceid = Column(Integer, primary_key=True)
+    variantid = Column(Integer, primary_key=True)
+    period = Column(Date, primary_key=True)
+    games = Column(Integer)
+    rating = Column(Numeric(10, 2))
+    deviation = Column(Numeric(10, 2))
+
+
+class RankingSnapshot(Base):
+    __tablename__ = 'ranking_snapshots'
+    snapshot_date = Column(Date, primary_key=True)
+    coachid = Column(Integer, primary_key=True)
+    raceid = Column(Integer, primary_key=True)
+    variantid = Column(Integer, primary_key=True)
+    dateupdate = Column(DateTime)
+    ranking = Column(Numeric(10, 2))
+    ranking_temp = Column(Numeric(10, 4))
+
+
+class RankingPosition(Base):
+    __tablename__ = 'ranking_positions'
+    variantid = Column(Integer, primary_key=True)
+    raceid = Column(Integer, primary_key=True)
+    coachid = Column(Integer, primary_key=True)
+    naf_name = Column(String(255))
+    country = Column(String(255))
+    ranking = Column(Numeric(10, 2))
+    race_position = Column(Integer)
+    race_percentile = Column(Numeric(5, 2))
+    variant_position = Column(Integer)
+    variant_percentile = Column(Numeric(5, 2))
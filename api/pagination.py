@@ -0,0 +1,92 @@
+import base64
+import binascii
+import json
+import os
+from datetime import date, timedelta
+from fastapi import HTTPException
+from sqlalchemy import func, literal_column, tuple_
+
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+EPOCH = date(1970, 1, 1)
+NO_DATE = literal_column("DATE 'infinity'")
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def load_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def decode_cursor(cursor, keys):
+    # Cursors are the base64 encoded primary key of the last item of the previous page
+    if cursor is None:
+        return None
+    values = load_cursor(cursor)
+    if not isinstance(values, list) or len(values) != len(keys) or not all(type(value) is int for value in values):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def paginate(query, keys, cursor, limit):
+    # Keyset pagination: filter after the cursor and order by the primary key so the index is used
+    if cursor is not None:
+        if len(keys) == 1:
+            query = query.where(keys[0] > cursor[0])
+        else:
+            query = query.where(tuple_(*keys) > tuple_(*cursor))
+    # Fetch one extra row to know if there is a next page
+    return query.order_by(*keys).limit(limit + 1)
+
+
+def page(items, keys, limit):
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor([items[-1][key.key] for key in keys])
+    return {"items": items, "next": next_cursor}
+
+
+def date_order(column):
+    # Items without a date sort last as infinity, so a (date, key) index on this expression serves the pages as one range
+    return func.coalesce(column, NO_DATE)
+
+
+def decode_date_cursor(cursor):
+    # Cursors of the pages ordered by date are the days since 1970-01-01 of the last item, null when it has no date, and its key
+    if cursor is None:
+        return None
+    values = load_cursor(cursor)
+    if not isinstance(values, list) or len(values) != 2 or not (values[0] is None or type(values[0]) is int) or type(values[1]) is not int:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if values[0] is None:
+        return values
+    try:
+        return [EPOCH + timedelta(days=values[0]), values[1]]
+    except (OverflowError, ValueError):
+        # Days out of the range of a date
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def paginate_by_date(query, column, key, cursor, limit):
+    order = date_order(column)
+    if cursor is not None:
+        after = NO_DATE if cursor[0] is None else cursor[0]
+        query = query.where(tuple_(order, key) > tuple_(after, cursor[1]))
+    return query.order_by(order, key).limit(limit + 1)
+
+
+def page_by_date(items, column, key, limit):
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        days = None if last[column] is None else last[column].toordinal() - EPOCH.toordinal()
+        next_cursor = encode_cursor([days, last[key]])
+    return {"items": items, "next": next_cursor}
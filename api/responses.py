@@ -0,0 +1,27 @@
+from decimal import Decimal
+import orjson
+from fastapi.responses import JSONResponse
+from sqlalchemy import Row, RowMapping
+
+
+def json_default(value):
+    # Types orjson does not know, dates and datetimes are serialized by orjson itself
+    if isinstance(value, Row):
+        return value._asdict()
+    if isinstance(value, RowMapping):
+        return dict(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def as_dicts(result):
+    # Much cheaper than Row._asdict(), the keys are shared by all the rows
+    keys = tuple(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+class ORJSONResponse(JSONResponse):
+    # Endpoints return it directly with the rows of the query, FastAPI does not run them through jsonable_encoder
+    def render(self, content):
+        return orjson.dumps(content, default=json_default)
@@ -0,0 +1,52 @@
+import math
+import os
+import numpy as np
+
+
+# Glicko on the NAF scale, ratings start at 150 and a difference of 40 points means 10 to 1 odds
+RATING_INITIAL = float(os.getenv('RATING_INITIAL', '150'))
+RATING_DEVIATION = float(os.getenv('RATING_DEVIATION', '35'))
+RATING_MIN_DEVIATION = float(os.getenv('RATING_MIN_DEVIATION', '5'))
+# Deviation regained by every rating period without games
+RATING_DECAY = float(os.getenv('RATING_DECAY', '3.5'))
+RATING_SCALE = float(os.getenv('RATING_SCALE', '40'))
+# Length of a rating period: day, week or month
+RATING_PERIOD = os.getenv('RATING_PERIOD', 'month')
+
+
+def replay(periods, home, away, score, players,
+           initial=RATING_INITIAL, deviation=RATING_DEVIATION, min_deviation=RATING_MIN_DEVIATION,
+           decay=RATING_DECAY, scale=RATING_SCALE):
+    # periods: rating period of every game in ascending order, home and away: player index of each side,
+    # score: result of the home side (1 win, 0.5 draw, 0 loss), players: number of players.
+    # The games of a period are rated together against the ratings at its start, as Glicko does.
+    # Returns the player, period, rating, deviation and number of games of every player after every period it played
+    q = math.log(10) / scale
+    rating = np.full(players, initial)
+    rd = np.full(players, deviation)
+    last_played = np.full(players, -1, dtype=np.int64)
+    history = []
+    bounds = np.flatnonzero(np.diff(periods)) + 1
+    for start, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(periods)]))):
+        period = periods[start]
+        # Both sides of every game, the index of each player within the period and its opponent
+        sides = np.concatenate((home[start:end], away[start:end]))
+        opponents = np.concatenate((away[start:end], home[start:end]))
+        scores = np.concatenate((score[start:end], 1 - score[start:end]))
+        played, local = np.unique(sides, return_inverse=True)
+        # The deviation grows with the periods spent without playing
+        idle = np.where(last_played[played] < 0, 0, period - last_played[played])
+        pre_rd = np.minimum(np.sqrt(rd[played] ** 2 + decay ** 2 * idle), deviation)
+        opponent_rd = np.minimum(np.sqrt(rd[opponents] ** 2 + decay ** 2 * np.where(last_played[opponents] < 0, 0, period - last_played[opponents])), deviation)
+        g = 1 / np.sqrt(1 + 3 * q ** 2 * opponent_rd ** 2 / math.pi ** 2)
+        expected = 1 / (1 + np.exp(-q * g * (rating[sides] - rating[opponents])))
+        variance = np.bincount(local, q ** 2 * g ** 2 * expected * (1 - expected), len(played))
+        improvement = np.bincount(local, g * (scores - expected), len(played))
+        precision = 1 / pre_rd ** 2 + variance
+        rating[played] += q / precision * improvement
+        rd[played] = np.maximum(np.sqrt(1 / precision), min_deviation)
+        last_played[played] = period
+        history.append((played, np.full(len(played), period), rating[played], rd[played], np.bincount(local, minlength=len(played))))
+    if not history:
+        return tuple(np.empty(0) for _ in range(5))
+    return tuple(np.concatenate(column) for column in zip(*history))
@@ -2,10 +2,14 @@ import os
 import requests
 import zipfile
 import psycopg2
-from io import BytesIO
+import numpy as np
+from io import TextIOWrapper
 import csv
-import tempfile
-import shutil
+import hashlib
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from ratings import RATING_PERIOD, replay
 
 # Database configuration
 DB_CONFIG = {
@@ -140,24 +144,653 @@ tables = {
         'race': 'raceid'
     }]
 }
+# Summary tables computed from the loaded ones, built by full loads in this order.
+# They read the loaded tables from {source} and are built in {schema}, the staging schema, to be swapped in
+derived_tables = {
+    # One row per coach and game, a coach playing against themselves is only kept on the home side
+    'game_participants': """
+        INSERT INTO {schema}.game_participants
+        SELECT homecoachid, gameid, 'home', racehome, awaycoachid, raceaway, tournamentid, variantsid, date, goalshome, goalsaway,
+               COALESCE(badlyhurthome, 0) + COALESCE(serioushome, 0) + COALESCE(killshome, 0),
+               COALESCE(badlyhurtaway, 0) + COALESCE(seriousaway, 0) + COALESCE(killsaway, 0),
+               CASE WHEN goalshome > goalsaway THEN 'W' WHEN goalshome = goalsaway THEN 'D' WHEN goalshome < goalsaway THEN 'L' END
+        FROM {source}.games WHERE homecoachid IS NOT NULL
+        UNION ALL
+        SELECT awaycoachid, gameid, 'away', raceaway, homecoachid, racehome, tournamentid, variantsid, date, goalsaway, goalshome,
+               COALESCE(badlyhurtaway, 0) + COALESCE(seriousaway, 0) + COALESCE(killsaway, 0),
+               COALESCE(badlyhurthome, 0) + COALESCE(serioushome, 0) + COALESCE(killshome, 0),
+               CASE WHEN goalsaway > goalshome THEN 'W' WHEN goalsaway = goalshome THEN 'D' WHEN goalsaway < goalshome THEN 'L' END
+        FROM {source}.games WHERE awaycoachid IS NOT NULL AND awaycoachid IS DISTINCT FROM homecoachid;
+    """,
+    # Every game counts once for each coach as in game_participants, the casualties of a side are the ones it inflicted
+    'coach_stats': """
+        INSERT INTO {schema}.coach_stats
+        SELECT coachid, COALESCE(raceid, 0), COALESCE(variantid, 0), COUNT(*),
+               COUNT(*) FILTER (WHERE result = 'W'), COUNT(*) FILTER (WHERE result = 'D'), COUNT(*) FILTER (WHERE result = 'L'),
+               COALESCE(SUM(td_for), 0), COALESCE(SUM(td_against), 0), SUM(cas_for), SUM(cas_against), MIN(date), MAX(date)
+        FROM {schema}.game_participants
+        GROUP BY 1, 2, 3;
+    """,
+    # Every pair of coaches once, the lower NAF number is coach_a
+    'head_to_head': """
+        INSERT INTO {schema}.head_to_head
+        SELECT coach_a, coach_b, COUNT(*),
+               COUNT(*) FILTER (WHERE td_a > td_b), COUNT(*) FILTER (WHERE td_a = td_b), COUNT(*) FILTER (WHERE td_a < td_b),
+               COALESCE(SUM(td_a), 0), COALESCE(SUM(td_b), 0), array_agg(DISTINCT race_a), array_agg(DISTINCT race_b), MIN(date), MAX(date)
+        FROM (
+            SELECT LEAST(homecoachid, awaycoachid) AS coach_a, GREATEST(homecoachid, awaycoachid) AS coach_b,
+                   CASE WHEN homecoachid < awaycoachid THEN goalshome ELSE goalsaway END AS td_a,
+                   CASE WHEN homecoachid < awaycoachid THEN goalsaway ELSE goalshome END AS td_b,
+                   COALESCE(CASE WHEN homecoachid < awaycoachid THEN racehome ELSE raceaway END, 0) AS race_a,
+                   COALESCE(CASE WHEN homecoachid < awaycoachid THEN raceaway ELSE racehome END, 0) AS race_b, date
+            FROM {source}.games WHERE homecoachid <> awaycoachid
+        ) AS pairs
+        GROUP BY coach_a, coach_b;
+    """,
+    # Sums rather than averages so the years can be added up, games without a date cannot be placed in a year
+    'race_matchups': """
+        INSERT INTO {schema}.race_matchups
+        SELECT COALESCE(variantsid, 0), EXTRACT(YEAR FROM date)::int, COALESCE(racehome, 0), COALESCE(raceaway, 0), COUNT(*),
+               COUNT(*) FILTER (WHERE goalshome > goalsaway), COUNT(*) FILTER (WHERE goalshome = goalsaway), COUNT(*) FILTER (WHERE goalshome < goalsaway),
+               COALESCE(SUM(goalshome), 0), COALESCE(SUM(goalsaway), 0),
+               SUM(COALESCE(badlyhurthome, 0) + COALESCE(serioushome, 0) + COALESCE(killshome, 0)),
+               SUM(COALESCE(badlyhurtaway, 0) + COALESCE(seriousaway, 0) + COALESCE(killsaway, 0))
+        FROM {source}.games WHERE date IS NOT NULL
+        GROUP BY 1, 2, 3, 4;
+    """,
+    # Coaches registered without games are listed too, positions follow wins, draws, touchdown and casualty differences
+    'tournament_standings': """
+        INSERT INTO {schema}.tournament_standings
+        SELECT tournamentid, coachid,
+               RANK() OVER (PARTITION BY tournamentid ORDER BY wins DESC, draws DESC, td_for - td_against DESC, cas_for - cas_against DESC),
+               races, games, wins, draws, losses, td_for, td_against, td_for - td_against, cas_for, cas_against, cas_for - cas_against, awards
+        FROM (
+            SELECT tournamentid, coachid, COALESCE(registered.races, played.races) AS races, COALESCE(games, 0) AS games,
+                   COALESCE(wins, 0) AS wins, COALESCE(draws, 0) AS draws, COALESCE(losses, 0) AS losses,
+                   COALESCE(td_for, 0) AS td_for, COALESCE(td_against, 0) AS td_against,
+                   COALESCE(cas_for, 0) AS cas_for, COALESCE(cas_against, 0) AS cas_against, awards
+            FROM (
+                SELECT tournamentid, coachid, array_agg(DISTINCT raceid) FILTER (WHERE raceid IS NOT NULL) AS races, COUNT(*) AS games,
+                       COUNT(*) FILTER (WHERE result = 'W') AS wins, COUNT(*) FILTER (WHERE result = 'D') AS draws, COUNT(*) FILTER (WHERE result = 'L') AS losses,
+                       SUM(td_for) AS td_for, SUM(td_against) AS td_against, SUM(cas_for) AS cas_for, SUM(cas_against) AS cas_against
+                FROM {schema}.game_participants WHERE tournamentid IS NOT NULL
+                GROUP BY tournamentid, coachid
+            ) AS played
+            FULL JOIN (
+                SELECT tournamentid, coachid, array_agg(raceid ORDER BY raceid) AS races
+                FROM {source}.tournament_coaches GROUP BY tournamentid, coachid
+            ) AS registered USING (tournamentid, coachid)
+            LEFT JOIN (
+                SELECT tournamentid, coachid, array_agg(typeid ORDER BY typeid) AS awards
+                FROM {source}.tournament_statistics GROUP BY tournamentid, coachid
+            ) AS won USING (tournamentid, coachid)
+        ) AS standings;
+    """,
+    # Best ranking first, ties share the position; the percentile is the share of the rankings at or below this one
+    'ranking_positions': """
+        INSERT INTO {schema}.ranking_positions
+        SELECT r.variantid, r.raceid, r.coachid, m.naf_name, m.country, r.ranking,
+               RANK() OVER (PARTITION BY r.variantid, r.raceid ORDER BY r.ranking DESC),
+               round((100 * CUME_DIST() OVER (PARTITION BY r.variantid, r.raceid ORDER BY r.ranking))::numeric, 2),
+               RANK() OVER (PARTITION BY r.variantid ORDER BY r.ranking DESC),
+               round((100 * CUME_DIST() OVER (PARTITION BY r.variantid ORDER BY r.ranking))::numeric, 2)
+        FROM {source}.coach_ranking_variant r LEFT JOIN {source}.members m ON m.naf_number = r.coachid
+        WHERE r.ranking IS NOT NULL;
+    """,
+    # Replayed in Python by the rating engine
+    'rating_history': lambda cursor, schema, source: build_rating_history(cursor, schema, source),
+}
+# Derived tables an incremental load refreshes in place. The groups of rows its changes reach are rebuilt with the query above,
+# run on temporary slices of its sources that hold what those groups read. The other derived tables are rebuilt and swapped
+refreshed_tables = {
+    'game_participants': {
+        'groups': ['gameid'],
+        'changed': "SELECT gameid FROM {previous}.games_touched",
+        'sources': {
+            'games': "SELECT g.* FROM public.games g JOIN {groups} r ON r.gameid = g.gameid",
+        },
+    },
+    # Both the groups the changed games left and the ones they joined
+    'coach_stats': {
+        'groups': ['coachid', 'raceid', 'variantid'],
+        'changed': """
+            SELECT coachid, COALESCE(raceid, 0), COALESCE(variantid, 0) FROM {previous}.game_participants
+            UNION
+            SELECT coachid, COALESCE(raceid, 0), COALESCE(variantid, 0) FROM public.game_participants p
+            WHERE EXISTS (SELECT 1 FROM {previous}.games_touched t WHERE t.gameid = p.gameid)
+        """,
+        'sources': {
+            'game_participants': """
+                SELECT p.* FROM public.game_participants p
+                JOIN {groups} r ON r.coachid = p.coachid AND r.raceid = COALESCE(p.raceid, 0) AND r.variantid = COALESCE(p.variantid, 0)
+            """,
+        },
+    },
+    'head_to_head': {
+        'groups': ['coach_a', 'coach_b'],
+        'changed': """
+            SELECT LEAST(homecoachid, awaycoachid), GREATEST(homecoachid, awaycoachid) FROM {previous}.games WHERE homecoachid <> awaycoachid
+            UNION
+            SELECT LEAST(homecoachid, awaycoachid), GREATEST(homecoachid, awaycoachid) FROM public.games g
+            WHERE homecoachid <> awaycoachid AND EXISTS (SELECT 1 FROM {previous}.games_touched t WHERE t.gameid = g.gameid)
+        """,
+        'sources': {
+            'games': """
+                SELECT g.* FROM public.games g
+                JOIN {groups} r ON r.coach_a = LEAST(g.homecoachid, g.awaycoachid) AND r.coach_b = GREATEST(g.homecoachid, g.awaycoachid)
+            """,
+        },
+    },
+    'tournament_standings': {
+        'groups': ['tournamentid'],
+        'changed': """
+            SELECT tournamentid FROM {previous}.game_participants
+            UNION
+            SELECT tournamentid FROM public.game_participants p
+            WHERE EXISTS (SELECT 1 FROM {previous}.games_touched t WHERE t.gameid = p.gameid)
+            UNION
+            SELECT tournamentid FROM {previous}.tournament_coaches_touched
+            UNION
+            SELECT tournamentid FROM {previous}.tournament_statistics_touched
+        """,
+        'sources': {
+            'game_participants': "SELECT p.* FROM public.game_participants p JOIN {groups} r ON r.tournamentid = p.tournamentid",
+            'tournament_coaches': "SELECT c.* FROM public.tournament_coaches c JOIN {groups} r ON r.tournamentid = c.tournamentid",
+            'tournament_statistics': "SELECT s.* FROM public.tournament_statistics s JOIN {groups} r ON r.tournamentid = s.tournamentid",
+        },
+    },
+}
+# Tables built in the staging schema and swapped in by a full load
+staged_tables = [*tables.keys(), 'load_hashes', *derived_tables.keys()]
 # File URL
 FILE_URL = os.getenv('FILE_URL', "https://member.thenaf.net/glicko/nafstat-tmp-name.zip")
 DOWNLOAD_DIR = os.getenv('DOWNLOAD_DIR', '/tmp')
-EXTRACT_DIR = os.getenv('EXTRACT_DIR', "/tmp/nafstat")
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', str(1024 * 1024)))
+SCHEMA_FILE = os.getenv('SCHEMA_FILE', '/app/init.sql')
+COPY_BATCH_SIZE = int(os.getenv('COPY_BATCH_SIZE', '1000'))
+# Every load is built in the staging schema and swapped in, the replaced tables are kept in the previous schema
+STAGING_SCHEMA = 'naf_staging'
+PREVIOUS_SCHEMA = 'naf_previous'
+SWAP_SCHEMA = 'naf_swap'
+SWAP_LOCK_TIMEOUT = os.getenv('SWAP_LOCK_TIMEOUT', '5s')
+SWAP_RETRIES = int(os.getenv('SWAP_RETRIES', '10'))
+HASHES_FETCH_SIZE = int(os.getenv('HASHES_FETCH_SIZE', '50000'))
+# Monthly partitions of ranking snapshots older than this are detached and moved to the archive schema, 0 keeps them all
+SNAPSHOT_RETENTION_MONTHS = int(os.getenv('SNAPSHOT_RETENTION_MONTHS', '0'))
+ARCHIVE_SCHEMA = 'naf_archive'
+# Tables are loaded in parallel by this many processes, each with its own connection
+LOAD_WORKERS = int(os.getenv('LOAD_WORKERS', '4'))
+INDEX_MAINTENANCE_WORK_MEM = os.getenv('INDEX_MAINTENANCE_WORK_MEM', '256MB')
 
-def get_missing_naf_numbers():
+def apply_schema():
+    # init.sql is idempotent, applying it brings databases created by older versions up to date
+    if not os.path.exists(SCHEMA_FILE):
+        return
     conn = psycopg2.connect(**DB_CONFIG)
     cursor = conn.cursor()
-    cursor.execute("SELECT MIN(naf_number), MAX(naf_number) FROM members;")
-    min_naf, max_naf = cursor.fetchone()
-    cursor.execute("SELECT naf_number FROM members;")
-    existing_numbers = {row[0] for row in cursor.fetchall()}
-    missing_numbers = [num for num in range(min_naf, max_naf + 1) if num not in existing_numbers]
+    with open(SCHEMA_FILE, 'r') as file:
+        cursor.execute(file.read())
+    conn.commit()
     cursor.close()
     conn.close()
-    return missing_numbers
+    print(f"Schema applied from {SCHEMA_FILE}")
+
+def stamp_dataset_version(cursor, download=None):
+    download = download or {}
+    cursor.execute("""
+        INSERT INTO public.dataset_version (etag, last_modified, content_length)
+        VALUES (%s, %s, %s) RETURNING version;
+    """, (download.get('etag'), download.get('last_modified'), download.get('content_length')))
+    return cursor.fetchone()[0]
+
+def previous_download():
+    # Validators of the dump behind the current dataset
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute("SELECT etag, last_modified, content_length FROM public.dataset_version ORDER BY version DESC LIMIT 1;")
+    row = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    if row is None:
+        return None
+    return {'etag': row[0], 'last_modified': row[1], 'content_length': row[2]}
+
+def table_constraints(cursor, contypes, table_names=staged_tables):
+    # Definitions are read with an empty search_path so referenced tables come schema qualified
+    cursor.execute("SET search_path TO pg_catalog;")
+    cursor.execute("""
+        SELECT t.relname, c.conname, pg_get_constraintdef(c.oid)
+        FROM pg_constraint c JOIN pg_class t ON t.oid = c.conrelid
+        WHERE t.relnamespace = 'public'::regnamespace AND t.relname = ANY(%s) AND c.contype::text = ANY(%s)
+        ORDER BY t.relname, c.conname;
+    """, (table_names, contypes))
+    constraints = cursor.fetchall()
+    cursor.execute("RESET search_path;")
+    return constraints
+
+def table_indexes(cursor, table_names=staged_tables):
+    # Indexes that do not back a constraint
+    cursor.execute("SET search_path TO pg_catalog;")
+    cursor.execute("""
+        SELECT pg_get_indexdef(i.indexrelid)
+        FROM pg_index i JOIN pg_class t ON t.oid = i.indrelid
+        WHERE t.relnamespace = 'public'::regnamespace AND t.relname = ANY(%s)
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+        ORDER BY t.relname;
+    """, (table_names,))
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute("RESET search_path;")
+    return indexes
+
+def primary_keys():
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT t.relname, array_agg(a.attname::text ORDER BY array_position(i.indkey::int2[], a.attnum))
+        FROM pg_index i JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = ANY(i.indkey)
+        WHERE i.indisprimary AND t.relnamespace = 'public'::regnamespace AND t.relname = ANY(%s)
+        GROUP BY t.relname;
+    """, (staged_tables,))
+    keys = dict(cursor.fetchall())
+    cursor.close()
+    conn.close()
+    return keys
+
+def table_dependencies():
+    # Foreign keys between the tables, every table maps to the ones it references
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT t.relname, r.relname
+        FROM pg_constraint c JOIN pg_class t ON t.oid = c.conrelid JOIN pg_class r ON r.oid = c.confrelid
+        WHERE c.contype = 'f' AND t.relnamespace = 'public'::regnamespace AND t.relname = ANY(%s) AND r.relname <> t.relname;
+    """, (list(tables.keys()),))
+    dependencies = {table: set() for table in tables.keys()}
+    for table, referenced in cursor.fetchall():
+        dependencies[table].add(referenced)
+    cursor.close()
+    conn.close()
+    return dependencies
+
+def topological_order(dependencies):
+    order = []
+    pending = dict(dependencies)
+    while pending:
+        ready = [table for table, referenced in pending.items() if not referenced - set(order)]
+        if not ready:
+            raise ValueError(f"Circular foreign keys between {', '.join(pending)}")
+        order.extend(ready)
+        for table in ready:
+            del pending[table]
+    return order
+
+def table_columns(cursor, table):
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s AND is_generated = 'NEVER'
+        ORDER BY ordinal_position;
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
 
-def download_file(url, download_path):
+def create_staging(key_columns, incremental):
+    # Empty copies of the tables with their primary keys, the rest of the indexes are built after the load.
+    # Incremental loads only stage the changes, they are thrown away once applied so they skip the WAL
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {STAGING_SCHEMA} CASCADE;")
+    cursor.execute(f"CREATE SCHEMA {STAGING_SCHEMA};")
+    for table in staged_tables:
+        # The derived tables are swapped in by both kinds of load
+        unlogged = 'UNLOGGED ' if incremental and table not in derived_tables else ''
+        cursor.execute(f"CREATE {unlogged}TABLE {STAGING_SCHEMA}.{table} (LIKE public.{table} INCLUDING ALL EXCLUDING INDEXES);")
+    for table, name, definition in table_constraints(cursor, ['p', 'u']):
+        cursor.execute(f"ALTER TABLE {STAGING_SCHEMA}.{table} ADD CONSTRAINT {name} {definition};")
+    if incremental:
+        # Primary keys of the rows that are gone from the dump
+        for table in tables.keys():
+            cursor.execute(f"CREATE UNLOGGED TABLE {STAGING_SCHEMA}.{table}_deleted AS SELECT {', '.join(key_columns[table])} FROM public.{table} WITH NO DATA;")
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"Staging schema {STAGING_SCHEMA} created")
+
+def build_index(definition):
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute("SET maintenance_work_mem = %s;", (INDEX_MAINTENANCE_WORK_MEM,))
+    cursor.execute(definition)
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+def finalize_staging(table_names=staged_tables):
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    # The indexes were left out of the load, they are built in parallel now that the tables are full
+    definitions = [definition.replace(' ON public.', f' ON {STAGING_SCHEMA}.', 1) for definition in table_indexes(cursor, table_names)]
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        list(executor.map(build_index, definitions))
+    for table, name, definition in table_constraints(cursor, ['f'], table_names):
+        definition = definition.replace(' REFERENCES public.', f' REFERENCES {STAGING_SCHEMA}.')
+        cursor.execute(f"ALTER TABLE {STAGING_SCHEMA}.{table} ADD CONSTRAINT {name} {definition};")
+    for table in table_names:
+        cursor.execute(f"ANALYZE {STAGING_SCHEMA}.{table};")
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"Constraints, indexes and statistics built in {STAGING_SCHEMA}")
+
+def swap_schema(source, download=None, table_names=staged_tables, add_to_previous=False):
+    # Atomically replace the public tables with the ones in source, the replaced ones end up in the previous schema.
+    # With add_to_previous they join the rows kept there by apply_changes instead of replacing the schema
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    for attempt in range(1, SWAP_RETRIES + 1):
+        try:
+            # Do not queue behind long running api queries, it would block every other query meanwhile
+            cursor.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}';")
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SWAP_SCHEMA} CASCADE;")
+            cursor.execute(f"CREATE SCHEMA {SWAP_SCHEMA};")
+            # Loads made before a table was added do not have it, the current one is kept
+            cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = %s;", (source,))
+            source_tables = {row[0] for row in cursor.fetchall()}
+            swapped = [table for table in table_names if table in source_tables]
+            for table in swapped:
+                cursor.execute(f"ALTER TABLE public.{table} SET SCHEMA {SWAP_SCHEMA};")
+                cursor.execute(f"ALTER TABLE {source}.{table} SET SCHEMA public;")
+            cursor.execute(f"DROP SCHEMA {source} CASCADE;")
+            if add_to_previous:
+                for table in swapped:
+                    cursor.execute(f"ALTER TABLE {SWAP_SCHEMA}.{table} SET SCHEMA {PREVIOUS_SCHEMA};")
+                cursor.execute(f"DROP SCHEMA {SWAP_SCHEMA} CASCADE;")
+            else:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {PREVIOUS_SCHEMA} CASCADE;")
+                cursor.execute(f"ALTER SCHEMA {SWAP_SCHEMA} RENAME TO {PREVIOUS_SCHEMA};")
+            version = stamp_dataset_version(cursor, download)
+            conn.commit()
+            break
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            if attempt == SWAP_RETRIES:
+                raise
+            print(f"Tables busy, retrying the swap ({attempt}/{SWAP_RETRIES})")
+            time.sleep(attempt)
+    cursor.close()
+    conn.close()
+    print(f"Dataset version {version} swapped in from {source}")
+
+def upsert_rows(cursor, table, keys, source):
+    columns = ', '.join(table_columns(cursor, table))
+    updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in table_columns(cursor, table) if column not in keys)
+    cursor.execute(f"""
+        INSERT INTO public.{table} ({columns})
+        SELECT {columns} FROM {source}.{table}
+        ON CONFLICT ({', '.join(keys)}) {f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'};
+    """)
+
+def save_rows(cursor, table, keys, schema):
+    # Copy the public rows of the keys listed in {schema}.{table}_touched to {schema}.{table}
+    match = ' AND '.join(f"t.{key} = d.{key}" for key in keys)
+    cursor.execute(f"""
+        CREATE TABLE {schema}.{table} AS
+        SELECT {', '.join(f't.{column}' for column in table_columns(cursor, table))} FROM public.{table} t
+        WHERE EXISTS (SELECT 1 FROM {schema}.{table}_touched d WHERE {match});
+    """)
+
+def save_previous(cursor, key_columns, order):
+    # The keys every table is about to change and the rows they had, rollback puts them back
+    cursor.execute(f"DROP SCHEMA IF EXISTS {PREVIOUS_SCHEMA} CASCADE;")
+    cursor.execute(f"CREATE SCHEMA {PREVIOUS_SCHEMA};")
+    for table in order:
+        keys = ', '.join(key_columns[table])
+        cursor.execute(f"""
+            CREATE TABLE {PREVIOUS_SCHEMA}.{table}_touched AS
+            SELECT {keys} FROM {STAGING_SCHEMA}.{table} UNION SELECT {keys} FROM {STAGING_SCHEMA}.{table}_deleted;
+        """)
+        save_rows(cursor, table, key_columns[table], PREVIOUS_SCHEMA)
+    deleted = ' UNION '.join(
+        f"SELECT '{table}', concat_ws(',', {', '.join(key_columns[table])}) FROM {STAGING_SCHEMA}.{table}_deleted" for table in order
+    )
+    cursor.execute(f"""
+        CREATE TABLE {PREVIOUS_SCHEMA}.load_hashes_touched AS
+        SELECT table_name, key FROM {STAGING_SCHEMA}.load_hashes UNION {deleted};
+    """)
+    save_rows(cursor, 'load_hashes', key_columns['load_hashes'], PREVIOUS_SCHEMA)
+
+def apply_changes(key_columns, order):
+    # Apply the staged changes to the live tables in one transaction, readers keep seeing the old rows until it commits
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    save_previous(cursor, key_columns, order)
+    for table in order:
+        upsert_rows(cursor, table, key_columns[table], STAGING_SCHEMA)
+        print(f"{cursor.rowcount} rows inserted or updated in {table}")
+        if table == 'members':
+            # The new rows of the tables that reference members may point to numbers missing from the dump
+            backfill_members(cursor, 'public', touched=f"{PREVIOUS_SCHEMA}.members_touched")
+    # Children first so the foreign keys hold
+    for table in reversed(order):
+        keys = key_columns[table]
+        match = ' AND '.join(f"t.{key} = d.{key}" for key in keys)
+        if table == 'members':
+            # Games still point to deleted members, they become placeholders as in a full load
+            cursor.execute(f"""
+                UPDATE public.members t SET naf_name = 'Deleted', country = 'Deleted', registration_date = '2000-01-01', expiry_date = NULL
+                FROM {STAGING_SCHEMA}.members_deleted d WHERE {match};
+            """)
+        else:
+            cursor.execute(f"DELETE FROM public.{table} t USING {STAGING_SCHEMA}.{table}_deleted d WHERE {match};")
+        print(f"{cursor.rowcount} rows deleted from {table}")
+        cursor.execute(f"""
+            DELETE FROM public.load_hashes h USING {STAGING_SCHEMA}.{table}_deleted d
+            WHERE h.table_name = %s AND h.key = concat_ws(',', {', '.join(f'd.{key}' for key in keys)});
+        """, (table,))
+    cursor.execute(f"""
+        INSERT INTO public.load_hashes SELECT * FROM {STAGING_SCHEMA}.load_hashes
+        ON CONFLICT (table_name, key) DO UPDATE SET hash = EXCLUDED.hash;
+    """)
+    # In the same transaction, the api never sees the loaded tables and their summaries out of step
+    for table in refreshed_tables:
+        refresh_derived(cursor, table, key_columns)
+    snapshot_rankings(cursor)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    print(f"Changes applied from {STAGING_SCHEMA}")
+
+def previous_load_exists():
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM public.load_hashes);")
+    exists = cursor.fetchone()[0]
+    cursor.close()
+    conn.close()
+    return exists
+
+def previous_hashes(table_name):
+    conn = psycopg2.connect(**DB_CONFIG)
+    # Server side cursor, the hashes of the big tables are fetched in batches
+    cursor = conn.cursor(name='previous_hashes')
+    cursor.itersize = HASHES_FETCH_SIZE
+    cursor.execute("SELECT key, hash FROM public.load_hashes WHERE table_name = %s;", (table_name,))
+    hashes = {key: bytes(digest) for key, digest in cursor}
+    cursor.close()
+    conn.close()
+    return hashes
+
+def rollback():
+    # Bring back the previous load, running it again returns to the newer one.
+    # The tables a full load replaced are swapped back, the rows an incremental load changed are put back in place
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = %s;", (PREVIOUS_SCHEMA,))
+    previous_tables = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    conn.close()
+    if not previous_tables:
+        print("There is no previous load to roll back to.")
+        return
+    patched = [table for table in [*topological_order(table_dependencies()), 'load_hashes', *derived_tables.keys()] if f"{table}_touched" in previous_tables]
+    if not patched:
+        swap_schema(PREVIOUS_SCHEMA)
+        return
+    key_columns = primary_keys()
+    swapped = [table for table in staged_tables if table in previous_tables and table not in patched]
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    for attempt in range(1, SWAP_RETRIES + 1):
+        try:
+            cursor.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}';")
+            # The current rows of the same keys become the previous load, to roll forward again
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SWAP_SCHEMA} CASCADE;")
+            cursor.execute(f"CREATE SCHEMA {SWAP_SCHEMA};")
+            for table in patched:
+                cursor.execute(f"CREATE TABLE {SWAP_SCHEMA}.{table}_touched AS SELECT * FROM {PREVIOUS_SCHEMA}.{table}_touched;")
+                save_rows(cursor, table, key_columns[table], SWAP_SCHEMA)
+            # Parents first so the foreign keys hold
+            for table in patched:
+                upsert_rows(cursor, table, key_columns[table], PREVIOUS_SCHEMA)
+            # Children first, the rows the load added
+            for table in reversed(patched):
+                match = ' AND '.join(f"t.{key} = d.{key}" for key in key_columns[table])
+                kept = ' AND '.join(f"p.{key} = t.{key}" for key in key_columns[table])
+                cursor.execute(f"""
+                    DELETE FROM public.{table} t USING {PREVIOUS_SCHEMA}.{table}_touched d
+                    WHERE {match} AND NOT EXISTS (SELECT 1 FROM {PREVIOUS_SCHEMA}.{table} p WHERE {kept});
+                """)
+            for table in swapped:
+                cursor.execute(f"ALTER TABLE public.{table} SET SCHEMA {SWAP_SCHEMA};")
+                cursor.execute(f"ALTER TABLE {PREVIOUS_SCHEMA}.{table} SET SCHEMA public;")
+            cursor.execute(f"DROP SCHEMA {PREVIOUS_SCHEMA} CASCADE;")
+            cursor.execute(f"ALTER SCHEMA {SWAP_SCHEMA} RENAME TO {PREVIOUS_SCHEMA};")
+            version = stamp_dataset_version(cursor)
+            conn.commit()
+            break
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            if attempt == SWAP_RETRIES:
+                raise
+            print(f"Tables busy, retrying the rollback ({attempt}/{SWAP_RETRIES})")
+            time.sleep(attempt)
+    cursor.close()
+    conn.close()
+    print(f"Dataset version {version} rolled back from {PREVIOUS_SCHEMA}")
+
+def snapshot_rankings(cursor):
+    # Keep the rankings of every day, loading again on the same day replaces them
+    cursor.execute("SELECT CURRENT_DATE, date_trunc('month', CURRENT_DATE)::date, (date_trunc('month', CURRENT_DATE) + interval '1 month')::date;")
+    today, start, end = cursor.fetchone()
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS public.ranking_snapshots_{start:%Y_%m} PARTITION OF public.ranking_snapshots FOR VALUES FROM (%s) TO (%s);", (start, end))
+    cursor.execute("DELETE FROM public.ranking_snapshots WHERE snapshot_date = %s;", (today,))
+    cursor.execute("""
+        INSERT INTO public.ranking_snapshots (snapshot_date, coachid, raceid, variantid, dateupdate, ranking, ranking_temp)
+        SELECT %s, coachid, raceid, variantid, dateupdate, ranking, ranking_temp FROM public.coach_ranking_variant;
+    """, (today,))
+    print(f"{cursor.rowcount} rankings kept in the snapshot of {today}")
+    if SNAPSHOT_RETENTION_MONTHS:
+        archive_snapshots(cursor)
+
+def archive_snapshots(cursor):
+    # Detached partitions are plain tables, they can be dumped and dropped from the archive schema
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA};")
+    cursor.execute("SELECT (date_trunc('month', CURRENT_DATE) - make_interval(months => %s))::date;", (SNAPSHOT_RETENTION_MONTHS,))
+    oldest = f"ranking_snapshots_{cursor.fetchone()[0]:%Y_%m}"
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'public.ranking_snapshots'::regclass AND c.relname < %s ORDER BY c.relname;
+    """, (oldest,))
+    for (partition,) in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE public.ranking_snapshots DETACH PARTITION public.{partition};")
+        cursor.execute(f"ALTER TABLE public.{partition} SET SCHEMA {ARCHIVE_SCHEMA};")
+        print(f"Snapshots {partition} moved to {ARCHIVE_SCHEMA}")
+
+def build_derived(cursor, schema, source=None, table_names=None):
+    # Built from scratch in the staging schema, incremental loads read the loaded tables from public once the changes are applied
+    source = source or schema
+    for table, query in derived_tables.items():
+        if table_names is not None and table not in table_names:
+            continue
+        if callable(query):
+            query(cursor, schema, source)
+        else:
+            cursor.execute(query.format(schema=schema, source=source))
+        print(f"{cursor.rowcount} rows built in {schema}.{table}")
+
+def refresh_derived(cursor, table, key_columns):
+    # Rebuild in place the rows of the groups the applied changes reach, the rows they replace are kept for rollback
+    refresh = refreshed_tables[table]
+    groups = refresh['groups']
+    keys = ', '.join(key_columns[table])
+    match = ' AND '.join(f"t.{column} = r.{column}" for column in groups)
+    cursor.execute(f"CREATE TEMP TABLE refresh_groups ({', '.join(groups)}) AS {refresh['changed'].format(previous=PREVIOUS_SCHEMA)};")
+    for source, query in refresh['sources'].items():
+        cursor.execute(f"CREATE TEMP TABLE {source} AS {query.format(groups='refresh_groups')};")
+    cursor.execute(f"CREATE TEMP TABLE {table} (LIKE public.{table});")
+    cursor.execute(derived_tables[table].format(schema='pg_temp', source='pg_temp'))
+    cursor.execute(f"""
+        CREATE TABLE {PREVIOUS_SCHEMA}.{table}_touched AS
+        SELECT {', '.join(f't.{key}' for key in key_columns[table])} FROM public.{table} t JOIN refresh_groups r ON {match}
+        UNION SELECT {keys} FROM pg_temp.{table};
+    """)
+    save_rows(cursor, table, key_columns[table], PREVIOUS_SCHEMA)
+    cursor.execute(f"DELETE FROM public.{table} t USING refresh_groups r WHERE {match};")
+    cursor.execute(f"INSERT INTO public.{table} SELECT * FROM pg_temp.{table};")
+    print(f"{cursor.rowcount} rows rebuilt in {table}")
+    cursor.execute(f"DROP TABLE refresh_groups, {', '.join(f'pg_temp.{name}' for name in {*refresh['sources'], table})};")
+
+# Number of the rating period of a game, consecutive periods have consecutive numbers
+RATING_PERIODS = {
+    'day': "date - DATE '1970-01-01'",
+    'week': "(date - DATE '1970-01-05') / 7",
+    'month': "(EXTRACT(YEAR FROM date) * 12 + EXTRACT(MONTH FROM date) - 1)::int",
+}
+
+def build_rating_history(cursor, schema, source):
+    # Replay every game in order, players are the coach, race and variant triples as in coach_ranking_variant
+    cursor.execute(f"""
+        SELECT {RATING_PERIODS[RATING_PERIOD]}, date_trunc('{RATING_PERIOD}', date)::date - DATE '1970-01-01',
+               homecoachid, COALESCE(racehome, 0), awaycoachid, COALESCE(raceaway, 0), COALESCE(variantsid, 0), sign(goalshome - goalsaway)::int
+        FROM {source}.games
+        WHERE date IS NOT NULL AND goalshome IS NOT NULL AND goalsaway IS NOT NULL AND homecoachid <> awaycoachid
+        ORDER BY 1, gameid;
+    """)
+    games = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 8)
+    players, index = np.unique(np.concatenate((games[:, [2, 3, 6]], games[:, [4, 5, 6]])), axis=0, return_inverse=True)
+    index = index.reshape(-1)
+    player, period, rating, deviation, played = replay(games[:, 0], index[:len(games)], index[len(games):], (games[:, 7] + 1) / 2, len(players))
+    # Periods are stored by their first day
+    ordinals, first = np.unique(games[:, 0], return_index=True)
+    starts = (np.datetime64('1970-01-01') + games[first, 1]).astype(str)
+    period = starts[np.searchsorted(ordinals, period)]
+    players = players[player.astype(np.int64)]
+    cursor.copy_expert(f"COPY {schema}.rating_history FROM STDIN", CopyStream(rating_lines(players, period, rating, deviation, played)))
+
+def rating_lines(players, periods, ratings, deviations, played, batch_size=COPY_BATCH_SIZE):
+    lines = []
+    for (coachid, raceid, variantid), period, rating, deviation, games in zip(players.tolist(), periods.tolist(), ratings.tolist(), deviations.tolist(), played.tolist()):
+        lines.append(f"{coachid}\t{raceid}\t{variantid}\t{period}\t{games}\t{rating:.2f}\t{deviation:.2f}\n")
+        if len(lines) >= batch_size:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+def backfill_members(cursor, schema, touched=None):
+    # Games and rankings still reference deleted members, fill the gaps in the numbers with placeholders in one statement.
+    # The placeholders are added to the touched keys when given, rollback removes them
+    backfill = f"""
+        INSERT INTO {schema}.members (naf_number, naf_name, country, registration_date)
+        SELECT naf_number, %s, %s, %s
+        FROM generate_series((SELECT MIN(naf_number) FROM {schema}.members), (SELECT MAX(naf_number) FROM {schema}.members)) AS series(naf_number)
+        WHERE NOT EXISTS (SELECT 1 FROM {schema}.members m WHERE m.naf_number = series.naf_number)
+        ON CONFLICT (naf_number) DO NOTHING
+    """
+    if touched:
+        backfill = f"WITH backfilled AS ({backfill} RETURNING naf_number) INSERT INTO {touched} SELECT naf_number FROM backfilled"
+    cursor.execute(f"{backfill};", ("Deleted", "Deleted", "2000-01-01"))
+    print(f"{cursor.rowcount} placeholder members created in {schema}.members")
+
+def download_file(url, download_path, previous=None):
     with requests.Session() as session:
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
@@ -166,116 +799,215 @@ def download_file(url, download_path):
             "Accept-Encoding": "gzip, deflate, br",
             "Connection": "keep-alive",
         }
+        # Conditional request with the validators of the dump that was loaded last
+        if previous and previous['etag']:
+            headers["If-None-Match"] = previous['etag']
+        if previous and previous['last_modified']:
+            headers["If-Modified-Since"] = previous['last_modified']
         response = session.get(url, headers=headers, stream=True)
+        if response.status_code == 304:
+            print("The file has not been modified")
+            return None
         response.raise_for_status()
+        content_length = response.headers.get('Content-Length')
+        download = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_length': int(content_length) if content_length else None,
+        }
+        # Servers that ignore conditional requests still send the same validators for the same file
+        if previous and (download['etag'] or download['last_modified']) and download == previous:
+            response.close()
+            print("The file has not been modified")
+            return None
         with open(download_path, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=8192):
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
               file.write(chunk)
     print(f"File downloaded to {download_path}")
+    return download
+
+def zip_members(zip_path):
+    # CSV files of the dump by name, wherever they are in the archive
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        return {os.path.basename(name): name for name in zip_ref.namelist() if not name.endswith('/')}
+
+class CopyStream:
+    # File-like object that feeds COPY FROM STDIN from a generator of CSV chunks
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def read(self, size=-1):
+        # psycopg2 sends whatever is returned and reads again until it gets an empty string, so every call returns a whole chunk.
+        # Empty chunks are skipped, they would end the COPY
+        for chunk in self.chunks:
+            if chunk:
+                return chunk
+        return ''
+
+    readline = read
+
+class LineWriter:
+    # csv.writer target that keeps the last written line
+    def write(self, line):
+        self.line = line
+
+def copy_chunks(reader, key_index, previous, changes, batch_size=COPY_BATCH_SIZE):
+    # Rewrite the dump rows as comma separated CSV, dates with '-00-' (e.g. 0000-00-00) are nulled.
+    # Rows are hashed by primary key and only the ones not in previous are sent, what is left in previous was deleted
+    line_writer = LineWriter()
+    writer = csv.writer(line_writer)
+    lines = []
+    for row in reader:
+        writer.writerow([None if '-00-' in value else value for value in row])
+        key = ','.join(row[index] for index in key_index)
+        digest = hashlib.md5(line_writer.line.encode()).digest()
+        if previous.pop(key, None) != digest:
+            changes[key] = digest
+            lines.append(line_writer.line)
+            if len(lines) == batch_size:
+                yield ''.join(lines)
+                lines = []
+    yield ''.join(lines)
 
-def extract_zip(file_path, extract_to):
-    with zipfile.ZipFile(file_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_to)
-    print(f"File extracted to {extract_to}")
+def hash_lines(table_name, hashes):
+    for key, digest in hashes.items():
+        yield f"{table_name}\t{key}\t\\\\x{digest.hex()}\n"
 
-def import_to_postgres(file_path, table_name, column_mapping):
+def key_lines(keys):
+    for key in keys:
+        yield f"{key}\n"
+
+def import_to_postgres(zip_path, member, table_name, column_mapping, key_columns, previous, schema='public'):
     conn = psycopg2.connect(**DB_CONFIG)
     cursor = conn.cursor()
-    with open(file_path, 'r') as file:
+    changes = {}
+    # The CSV is read straight out of the archive, nothing is extracted to disk
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref, zip_ref.open(member) as raw:
+        reader = csv.reader(TextIOWrapper(raw, encoding='utf-8', newline=''), delimiter=';')
         # Replace headers in the CSV with the corresponding columns in the mapping
-        reader = csv.DictReader(file, delimiter=';')
-        temp_file = tempfile.NamedTemporaryFile(delete=False, mode='w', newline='')
-        writer = csv.DictWriter(temp_file, fieldnames=column_mapping.values())
-        writer.writeheader()
-
-        for row in reader:
-            mapped_row = {
-                column_mapping.get(key, key): (None if '-00-' in value else value)
-                for key, value in row.items()
-            }
-            writer.writerow(mapped_row)
-
-        temp_file.close()
-        file.close()
-
-        # Reopen the temporary file for the copy operation
-        file = open(temp_file.name, 'r')
-        cursor.copy_expert(f"COPY {table_name} FROM STDIN WITH CSV HEADER", file)
-        
+        columns = [column_mapping.get(key, key) for key in next(reader)]
+        key_index = [columns.index(key) for key in key_columns]
+        cursor.copy_expert(f"COPY {schema}.{table_name} ({', '.join(columns)}) FROM STDIN WITH CSV", CopyStream(copy_chunks(reader, key_index, previous, changes)))
+    cursor.copy_expert(f"COPY {schema}.load_hashes FROM STDIN", CopyStream(hash_lines(table_name, changes)))
+    if previous:
+        cursor.copy_expert(f"COPY {schema}.{table_name}_deleted FROM STDIN WITH CSV", CopyStream(key_lines(previous)))
     conn.commit()
-    print(f"Data imported to table {table_name}")
-    if table_name == 'members':
-        missing_naf_numbers = get_missing_naf_numbers()
-        if missing_naf_numbers:
-            for naf_number in missing_naf_numbers:
-                cursor.execute("""
-                    INSERT INTO members (naf_number, naf_name, country, registration_date)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (naf_number) DO NOTHING;
-                """, (naf_number, "Deleted", "Deleted", "2000-01-01"))
-            conn.commit()
+    print(f"{len(changes)} new or changed and {len(previous)} deleted rows imported to table {schema}.{table_name}", flush=True)
     cursor.close()
-    conn.close()            
+    conn.close()
+
+def load_table(table, zip_path, member, key_columns, incremental):
+    start = time.monotonic()
+    previous = previous_hashes(table) if incremental else {}
+    import_to_postgres(zip_path, member, table, column_mapping=tables[table][1], key_columns=key_columns, previous=previous, schema=STAGING_SCHEMA)
+    return time.monotonic() - start
 
-def main():
-    # Remove the extract directory if it exists
-    if os.path.exists(EXTRACT_DIR):
-        shutil.rmtree(EXTRACT_DIR)
+def load_tables(zip_path, members, key_columns, dependencies, incremental):
+    # Load the tables in parallel, each one starts as soon as the tables it references are loaded
+    start = time.monotonic()
+    timings = {}
+    pending = dict(dependencies)
+    running = {}
+    with ProcessPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        while pending or running:
+            for table in [table for table, referenced in pending.items() if not referenced - timings.keys()]:
+                print(f"Importing {tables[table][0]} to {table}")
+                running[executor.submit(load_table, table, zip_path, members[tables[table][0]], key_columns[table], incremental)] = table
+                del pending[table]
+            if not running:
+                raise ValueError(f"Circular foreign keys between {', '.join(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                timings[running.pop(future)] = future.result()
+    print("Load timings:")
+    for table, seconds in timings.items():
+        print(f"  {table}: {seconds:.2f}s")
+    print(f"  total: {time.monotonic() - start:.2f}s")
+
+def main(full=False):
     # Remove the zip file if it exists
     zip_path = os.path.join(DOWNLOAD_DIR, "nafstat.zip")
     if os.path.exists(zip_path):
         os.remove(zip_path)
-    if os.path.exists(EXTRACT_DIR):
-        shutil.rmtree(EXTRACT_DIR)
-    os.makedirs(EXTRACT_DIR, exist_ok=True)
-    zip_path = os.path.join(DOWNLOAD_DIR, "nafstat.zip")
+    apply_schema()
+    
+    # Step 1: Download the file, unless it is the same that was loaded last
+    download = download_file(FILE_URL, zip_path, previous=None if full else previous_download())
+    if download is None:
+        print("Nothing to load.")
+        return
     
-    # Step 1: Download the file
-    download_file(FILE_URL, zip_path)
+    # Step 2: List the files in the archive
+    members = zip_members(zip_path)
+    print(f"Files in the archive: {list(members)}")
+    # Step 2.5: Create empty tables to load the data into while the api keeps serving the current ones.
+    # When there is a previous load only the changes are loaded, otherwise all the tables are rebuilt
+    incremental = not full and previous_load_exists()
+    key_columns = primary_keys()
+    create_staging(key_columns, incremental)
+    # Step 2.6: Insert default values into the races and variants tables
+    if not incremental:
+        conn = psycopg2.connect(**DB_CONFIG)
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            INSERT INTO {STAGING_SCHEMA}.races (raceid, name, reroll_cost, apoth, race_order, selectable, race_count)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (raceid) DO NOTHING;
+        """, ("0", "Unknown", "0", "n", "6", None, "no"))
     
-    # Step 2: Extract the file
-    extract_zip(zip_path, EXTRACT_DIR)
-    # List the contents of the extracted directory
-    folder = os.listdir(EXTRACT_DIR)
-    print(f"Extracted files: {folder}")
-    # Step 2.5: Delete all data from the database tables
+        cursor.execute(f"""
+            INSERT INTO {STAGING_SCHEMA}.variants (variantid, variantname, variantorder)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (variantid) DO NOTHING;
+        """, ("6", "Deleted", "9998"))
+        cursor.execute(f"""
+            INSERT INTO {STAGING_SCHEMA}.variants (variantid, variantname, variantorder)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (variantid) DO NOTHING;
+        """, ("0", "Unknown", "9999"))
+        conn.commit()
+        cursor.close()
+        conn.close()
+        print("Default values inserted into the races table.")
+    # Step 3: Import the files of the archive to the database
+    dependencies = table_dependencies()
+    load_tables(zip_path, members, key_columns, dependencies, incremental)
+    if incremental:
+        # Step 4: Apply the changes to the live tables
+        apply_changes(key_columns, topological_order(dependencies))
+        # Step 5: Rebuild the derived tables that were not refreshed with the changes and swap them in,
+        # the new dataset version is stamped with them
+        rebuilt = [table for table in derived_tables if table not in refreshed_tables]
+        conn = psycopg2.connect(**DB_CONFIG)
+        cursor = conn.cursor()
+        build_derived(cursor, STAGING_SCHEMA, 'public', rebuilt)
+        conn.commit()
+        cursor.close()
+        conn.close()
+        finalize_staging(rebuilt)
+        swap_schema(STAGING_SCHEMA, download, rebuilt, add_to_previous=True)
+        os.remove(zip_path)
+        return
+    # Step 4: Build the indexes and swap the new tables in, the api sees the new dataset at once
     conn = psycopg2.connect(**DB_CONFIG)
     cursor = conn.cursor()
-    for table in tables.keys():
-        cursor.execute(f"TRUNCATE TABLE {table} CASCADE;")
+    backfill_members(cursor, STAGING_SCHEMA)
+    build_derived(cursor, STAGING_SCHEMA)
     conn.commit()
     cursor.close()
     conn.close()
-    print("All data deleted from the database.")
-    # Step 2.6: Insert default values into the races and variants tables
+    finalize_staging()
+    swap_schema(STAGING_SCHEMA, download)
     conn = psycopg2.connect(**DB_CONFIG)
     cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO races (raceid, name, reroll_cost, apoth, race_order, selectable, race_count)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (raceid) DO NOTHING;
-    """, ("0", "Unknown", "0", "n", "6", None, "no"))
-    
-    cursor.execute("""
-        INSERT INTO variants (variantid, variantname, variantorder)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (variantid) DO NOTHING;
-    """, ("6", "Deleted", "9998"))
-    cursor.execute("""
-        INSERT INTO variants (variantid, variantname, variantorder)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (variantid) DO NOTHING;
-    """, ("0", "Unknown", "9999"))
+    snapshot_rankings(cursor)
     conn.commit()
     cursor.close()
     conn.close()
-    print("Default values inserted into the races table.")
-    # Step 3: Import the extracted fileo the database
-    for table, path in tables.items():
-        print(f"Importing {path[0]} to {table}")
-        csv_file_path = os.path.join(EXTRACT_DIR, folder[-1], path[0])
-        import_to_postgres(csv_file_path, table, column_mapping=path[1])
-        
+    os.remove(zip_path)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if sys.argv[1:] == ['rollback']:
+        rollback()
+    else:
+        main(full=sys.argv[1:] == ['full'])
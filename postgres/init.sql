@@ -135,3 +135,210 @@ CREATE TABLE IF NOT EXISTS coach_ranking_variant (
     ranking_temp DECIMAL(10, 4),
     PRIMARY KEY (coachid, raceid, variantid)
 );
+
+-- Indexes for the filters of the api, the fetcher builds them after loading the data
+CREATE INDEX IF NOT EXISTS tournaments_tournamentorganizerid_idx ON tournaments (tournamentorganizerid);
+CREATE INDEX IF NOT EXISTS tournaments_tournamentstartdate_idx ON tournaments (tournamentstartdate);
+CREATE INDEX IF NOT EXISTS tournaments_variantsid_idx ON tournaments (variantsid);
+CREATE INDEX IF NOT EXISTS tournament_statistics_tournamentid_idx ON tournament_statistics (tournamentid);
+CREATE INDEX IF NOT EXISTS tournament_statistics_coachid_idx ON tournament_statistics (coachid);
+CREATE INDEX IF NOT EXISTS tournament_statistics_date_idx ON tournament_statistics (date);
+CREATE INDEX IF NOT EXISTS tournament_coaches_coachid_idx ON tournament_coaches (coachid);
+CREATE INDEX IF NOT EXISTS games_tournamentid_idx ON games (tournamentid);
+CREATE INDEX IF NOT EXISTS games_homecoachid_idx ON games (homecoachid);
+CREATE INDEX IF NOT EXISTS games_awaycoachid_idx ON games (awaycoachid);
+CREATE INDEX IF NOT EXISTS games_racehome_idx ON games (racehome);
+CREATE INDEX IF NOT EXISTS games_raceaway_idx ON games (raceaway);
+CREATE INDEX IF NOT EXISTS games_date_idx ON games (date);
+CREATE INDEX IF NOT EXISTS games_variantsid_idx ON games (variantsid);
+CREATE INDEX IF NOT EXISTS coach_ranking_variant_raceid_idx ON coach_ranking_variant (raceid);
+CREATE INDEX IF NOT EXISTS coach_ranking_variant_variantid_idx ON coach_ranking_variant (variantid);
+
+-- Trigram indexes for the substring (ILIKE '%...%') filters and the fuzzy search of names
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS members_naf_name_trgm_idx ON members USING gin (naf_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS members_country_trgm_idx ON members USING gin (country gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS tournaments_tournamentname_trgm_idx ON tournaments USING gin (tournamentname gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS tournaments_tournamentcity_trgm_idx ON tournaments USING gin (tournamentcity gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS tournaments_tournamentnation_trgm_idx ON tournaments USING gin (tournamentnation gin_trgm_ops);
+-- Name prefixes for autocomplete, in the C collation the same index serves the prefix match and the order of the names
+DROP INDEX IF EXISTS members_naf_name_prefix_idx;
+DROP INDEX IF EXISTS tournaments_tournamentname_prefix_idx;
+CREATE INDEX IF NOT EXISTS members_naf_name_prefix_c_idx ON members ((lower(naf_name) COLLATE "C"));
+CREATE INDEX IF NOT EXISTS tournaments_tournamentname_prefix_c_idx ON tournaments ((lower(tournamentname) COLLATE "C"));
+
+-- Full text search of the free text columns, computed by Postgres as the rows are loaded
+ALTER TABLE tournaments ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(tournamentname, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(tournamentinformation, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(tournamentreport, '')), 'C') ||
+    setweight(to_tsvector('english', coalesce(tournamentscoring, '')), 'D')
+) STORED;
+ALTER TABLE games ADD COLUMN IF NOT EXISTS notes_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', coalesce(notes, ''))) STORED;
+ALTER TABLE tournament_statistics ADD COLUMN IF NOT EXISTS notes_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', coalesce(notes, ''))) STORED;
+CREATE INDEX IF NOT EXISTS tournaments_search_vector_idx ON tournaments USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS games_notes_vector_idx ON games USING gin (notes_vector);
+CREATE INDEX IF NOT EXISTS tournament_statistics_notes_vector_idx ON tournament_statistics USING gin (notes_vector);
+
+-- Written by the fetcher at the end of every load, with the HTTP validators of the dump it loaded
+CREATE TABLE IF NOT EXISTS dataset_version (
+    version SERIAL PRIMARY KEY,
+    loaded_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    etag VARCHAR(255),
+    last_modified VARCHAR(255),
+    content_length BIGINT
+);
+ALTER TABLE dataset_version ADD COLUMN IF NOT EXISTS etag VARCHAR(255);
+ALTER TABLE dataset_version ADD COLUMN IF NOT EXISTS last_modified VARCHAR(255);
+ALTER TABLE dataset_version ADD COLUMN IF NOT EXISTS content_length BIGINT;
+
+-- Hash of every row of the last load by table and primary key, the next load only applies the rows that changed
+CREATE TABLE IF NOT EXISTS load_hashes (
+    table_name VARCHAR(63),
+    key TEXT,
+    hash BYTEA NOT NULL,
+    PRIMARY KEY (table_name, key)
+);
+
+-- Every game once for each coach that played it, built by the fetcher after every load.
+-- Coach scoped queries read it instead of matching the home or the away coach of the games
+CREATE TABLE IF NOT EXISTS game_participants (
+    coachid INT,
+    gameid INT,
+    side VARCHAR(4) NOT NULL,
+    raceid INT,
+    opponentid INT,
+    opponent_raceid INT,
+    tournamentid INT,
+    variantid INT,
+    date DATE,
+    td_for INT,
+    td_against INT,
+    cas_for INT NOT NULL,
+    cas_against INT NOT NULL,
+    result CHAR(1),
+    PRIMARY KEY (coachid, gameid)
+);
+-- The games of a coach by date, the ones without a date last as the api pages them
+DROP INDEX IF EXISTS game_participants_coachid_date_idx;
+CREATE INDEX IF NOT EXISTS game_participants_coachid_date_order_idx ON game_participants (coachid, COALESCE(date, 'infinity'::date), gameid);
+CREATE INDEX IF NOT EXISTS game_participants_raceid_idx ON game_participants (raceid, gameid);
+CREATE INDEX IF NOT EXISTS game_participants_tournamentid_idx ON game_participants (tournamentid, coachid);
+
+-- Record of every coach by race and variant, built by the fetcher from the games after every load
+CREATE TABLE IF NOT EXISTS coach_stats (
+    coachid INT,
+    raceid INT,
+    variantid INT,
+    games INT NOT NULL,
+    wins INT NOT NULL,
+    draws INT NOT NULL,
+    losses INT NOT NULL,
+    td_for INT NOT NULL,
+    td_against INT NOT NULL,
+    cas_for INT NOT NULL,
+    cas_against INT NOT NULL,
+    first_game DATE,
+    last_game DATE,
+    PRIMARY KEY (coachid, raceid, variantid)
+);
+
+-- Final table of every tournament from its games, with the races the coaches registered and the awards they won
+CREATE TABLE IF NOT EXISTS tournament_standings (
+    tournamentid INT,
+    coachid INT,
+    position INT NOT NULL,
+    races INT[],
+    games INT NOT NULL,
+    wins INT NOT NULL,
+    draws INT NOT NULL,
+    losses INT NOT NULL,
+    td_for INT NOT NULL,
+    td_against INT NOT NULL,
+    td_diff INT NOT NULL,
+    cas_for INT NOT NULL,
+    cas_against INT NOT NULL,
+    cas_diff INT NOT NULL,
+    awards INT[],
+    PRIMARY KEY (tournamentid, coachid)
+);
+CREATE INDEX IF NOT EXISTS tournament_standings_position_idx ON tournament_standings (tournamentid, position, coachid);
+
+-- Record between every pair of coaches that met, coach_a is the lower NAF number
+CREATE TABLE IF NOT EXISTS head_to_head (
+    coach_a INT,
+    coach_b INT,
+    games INT NOT NULL,
+    wins_a INT NOT NULL,
+    draws INT NOT NULL,
+    wins_b INT NOT NULL,
+    td_a INT NOT NULL,
+    td_b INT NOT NULL,
+    races_a INT[] NOT NULL,
+    races_b INT[] NOT NULL,
+    first_game DATE,
+    last_game DATE,
+    PRIMARY KEY (coach_a, coach_b)
+);
+-- The games between two coaches whoever played home, latest first and the ones without a date last
+DROP INDEX IF EXISTS games_coach_pair_idx;
+CREATE INDEX IF NOT EXISTS games_coach_pair_latest_idx ON games (LEAST(homecoachid, awaycoachid), GREATEST(homecoachid, awaycoachid), date DESC NULLS LAST, gameid DESC);
+
+-- Results of every home race against every away race by variant and year
+CREATE TABLE IF NOT EXISTS race_matchups (
+    variantid INT,
+    year INT,
+    racehome INT,
+    raceaway INT,
+    games INT NOT NULL,
+    home_wins INT NOT NULL,
+    draws INT NOT NULL,
+    away_wins INT NOT NULL,
+    td_home INT NOT NULL,
+    td_away INT NOT NULL,
+    cas_home INT NOT NULL,
+    cas_away INT NOT NULL,
+    PRIMARY KEY (variantid, year, racehome, raceaway)
+);
+
+-- Rating of every coach, race and variant after every rating period it played, replayed by the fetcher from the games
+CREATE TABLE IF NOT EXISTS rating_history (
+    coachid INT,
+    raceid INT,
+    variantid INT,
+    period DATE,
+    games INT NOT NULL,
+    rating DECIMAL(10, 2) NOT NULL,
+    deviation DECIMAL(10, 2) NOT NULL,
+    PRIMARY KEY (coachid, raceid, variantid, period)
+);
+
+-- Rankings of every day, the fetcher adds a partition per month and can move the old ones out to the naf_archive schema
+CREATE TABLE IF NOT EXISTS ranking_snapshots (
+    snapshot_date DATE,
+    coachid INT,
+    raceid INT,
+    variantid INT,
+    dateupdate TIMESTAMP,
+    ranking DECIMAL(10, 2),
+    ranking_temp DECIMAL(10, 4),
+    PRIMARY KEY (snapshot_date, coachid, raceid, variantid)
+) PARTITION BY RANGE (snapshot_date);
+CREATE INDEX IF NOT EXISTS ranking_snapshots_coachid_idx ON ranking_snapshots (coachid, raceid, variantid, snapshot_date);
+
+-- Position and percentile of every ranking among the rankings of its race and variant and among all the rankings of its variant
+CREATE TABLE IF NOT EXISTS ranking_positions (
+    variantid INT,
+    raceid INT,
+    coachid INT,
+    naf_name VARCHAR(255),
+    country VARCHAR(255),
+    ranking DECIMAL(10, 2) NOT NULL,
+    race_position INT NOT NULL,
+    race_percentile DECIMAL(5, 2) NOT NULL,
+    variant_position INT NOT NULL,
+    variant_percentile DECIMAL(5, 2) NOT NULL,
+    PRIMARY KEY (variantid, raceid, coachid)
+);
+CREATE INDEX IF NOT EXISTS ranking_positions_race_position_idx ON ranking_positions (variantid, raceid, race_position, coachid);
+CREATE INDEX IF NOT EXISTS ranking_positions_variant_position_idx ON ranking_positions (variantid, variant_position, raceid, coachid);